@@ -0,0 +1,226 @@
+"""
+Combined ESG analysis of texts with the coarse ESG classifier, the fine ESG topic classifier and the ESG sentiment model.
+Calling is_esg_related, get_esg_topic and get_esg_sentiment in turn tokenizes the same texts once per model and
+builds a list of dictionaries for every text. EsgTextAnalysis.analyze instead tokenizes the texts once for each distinct
+tokenizer (the two FinBERT models share their vocabulary), runs the models that share a tokenizer back to back on the
+same batches of tensors and returns the results for all the texts as arrays.
+"""
+import hashlib
+import logging
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import torch
+
+from .batching import DEFAULT_CHUNK_SIZE, iter_chunks, run_shared_batched_inference
+from .classification import EsgTextClassification
+from .esg_sentiment_analysis import EsgSentimentAnalysis, SENTIMENT_LABELS
+from .result_cache import model_cache_key, text_hash
+
+ANALYSIS_TASKS = ("coarse", "topic", "sentiment")
+_RESULT_KEYS = {"coarse": ("coarse_label", "coarse_prob"), "topic": ("topic", "topic_prob")}
+
+
+def rescale_sentiment_probabilities(probs: np.ndarray) -> np.ndarray:
+    """
+    Rescales the probabilities of the 3 sentiments (texts x SENTIMENT_LABELS) into a single value per text in the
+    range -1 to 1, where:
+        - values close to +1 indicate a high probability of a Positive sentiment
+        - values close to -1 indicate a high probability of a Negative sentiment
+        - values close to 0 indicate a high probability of a Neutral sentiment
+    """
+    positive, negative = SENTIMENT_LABELS.index("Positive"), SENTIMENT_LABELS.index("Negative")
+    # Stable sort so that ties are resolved in label order, as with the sorted lists of get_esg_sentiment
+    order = np.argsort(-probs, axis=1, kind="stable")
+    top_label = order[:, 0]
+    # Normalise into a range between 0 to 2/3
+    top_prob = probs[np.arange(len(probs)), top_label] * (2.0 / 3.0)
+
+    # Most likely Neutral: definitely neutral should be 0, and less neutral should move closer to -1 or +1 depending
+    # on the next most likely sentiment. So shift to the range -1/3 to 0 and flip to 0 to 1/3 if the next most likely
+    # is Positive
+    rescaled = (top_prob / 2.0) - (1.0 / 3.0)
+    rescaled = np.where(order[:, 1] == positive, -rescaled, rescaled)
+    # Most likely Positive: shift to the range +1/3 to 1, most likely Negative: shift to the range -1/3 to -1
+    rescaled = np.where(top_label == positive, (1.0 / 3.0) + top_prob, rescaled)
+    rescaled = np.where(top_label == negative, (-1.0 / 3.0) - top_prob, rescaled)
+    return rescaled
+
+
+def _tokenizer_signature(tokenizer) -> str:
+    """
+    Returns a hash that is the same for tokenizers that tokenize text in the same way.
+    Fast tokenizers are compared on their full serialised definition (vocabulary, normaliser, pre-tokenizer etc.),
+    other tokenizers on their vocabulary and casing
+    """
+    if hasattr(tokenizer, "backend_tokenizer"):
+        definition = tokenizer.backend_tokenizer.to_str()
+    else:
+        definition = repr((sorted(tokenizer.get_vocab().items()), getattr(tokenizer, "do_lower_case", None)))
+    return hashlib.sha256(f"{type(tokenizer).__name__}:{definition}".encode("utf-8")).hexdigest()
+
+
+def _run_models(texts: List[str], tokenizer, models: List, max_tokens: int) -> List[torch.Tensor]:
+    """Runs the models that share the tokenizer on the texts, or sends the texts to the inference service"""
+    if tokenizer is None:
+        return [model.predict(texts) for model in models]
+    return run_shared_batched_inference(texts, tokenizer, models, max_length=512, max_tokens=max_tokens)
+
+
+def _empty_results(tasks) -> Dict[str, np.ndarray]:
+    """Returns the results of analysing an empty list of texts"""
+    results = {}
+    for task in tasks:
+        if task == "sentiment":
+            results["sentiment"] = np.zeros(0)
+        else:
+            label_key, prob_key = _RESULT_KEYS[task]
+            results[label_key] = np.array([], dtype=object)
+            results[prob_key] = np.zeros(0, dtype=np.float32)
+    return results
+
+
+class EsgTextAnalysis:
+    """
+    Runs the coarse ESG classification, fine ESG topic classification and ESG sentiment analysis of texts together.
+    Params:
+        classifier: the EsgTextClassification to use for the coarse and fine classifiers. Created if None
+        sentiment_analyser: the EsgSentimentAnalysis to use for the sentiment model. Created if None
+        lazy_load: if False, the models are loaded when the class is instantiated rather than when first used
+        backend: the backend used to run the models if the classifiers are created (see backends.py)
+    """
+
+    def __init__(self, classifier: EsgTextClassification = None, sentiment_analyser: EsgSentimentAnalysis = None,
+                 lazy_load=True, backend="torch"):
+        self.log = logging.getLogger("EsgTextAnalysis")
+        self.classifier = classifier if classifier is not None else EsgTextClassification(backend=backend)
+        self.sentiment_analyser = sentiment_analyser if sentiment_analyser is not None else EsgSentimentAnalysis(
+            backend=backend)
+        self._signatures = {}
+
+        if not lazy_load:
+            for task in ANALYSIS_TASKS:
+                self._get_tokenizer_and_model(task)
+
+    def _get_tokenizer_and_model(self, task: str):
+        if task == "coarse":
+            if self.classifier.esg_course_classifier_model is None:
+                self.classifier._load_esg_course_classifier()
+            return self.classifier.esg_course_classifier_tokenizer, self.classifier.esg_course_classifier_model
+        if task == "topic":
+            if self.classifier.esg_fine_classifier_model is None:
+                self.classifier._load_esg_fine_classifier()
+            return self.classifier.esg_fine_classifier_tokenizer, self.classifier.esg_fine_classifier_model
+        if task == "sentiment":
+            if self.sentiment_analyser.esg_sentiment_analysis_model is None:
+                self.sentiment_analyser._load_esg_sentiment_analysis()
+            return (self.sentiment_analyser.esg_sentiment_analysis_tokenizer,
+                    self.sentiment_analyser.esg_sentiment_analysis_model)
+        raise ValueError(f"Unknown analysis task '{task}'. Supported tasks are {ANALYSIS_TASKS}")
+
+    def _owner(self, task: str):
+        """Returns the classifier instance that owns the model of the task"""
+        return self.sentiment_analyser if task == "sentiment" else self.classifier
+
+    def _signature(self, tokenizer) -> str:
+        # Computing the signature serialises the tokenizer so it is only done once per tokenizer
+        if id(tokenizer) not in self._signatures:
+            self._signatures[id(tokenizer)] = (tokenizer, _tokenizer_signature(tokenizer))
+        return self._signatures[id(tokenizer)][1]
+
+    def _group_by_tokenizer(self, tasks) -> List[Tuple[object, List[str], List]]:
+        """Groups the tasks by the tokenizer of their models so that texts are tokenized once per distinct tokenizer"""
+        groups = {}
+        for task in tasks:
+            tokenizer, model = self._get_tokenizer_and_model(task)
+            # Models run by the inference service are tokenized by the service so are not grouped
+            signature = self._signature(tokenizer) if tokenizer is not None else f"remote:{task}"
+            if signature not in groups:
+                groups[signature] = (tokenizer, [], [])
+            groups[signature][1].append(task)
+            groups[signature][2].append(model)
+        return list(groups.values())
+
+    def _cached_shared_inference(self, texts: List[str], tokenizer, tasks: List[str], models: List) -> List:
+        """
+        Runs the models that share a tokenizer on the texts, using the result caches of the classifiers.
+        Texts that are cached for every model are not tokenized, the rest are run through all the models together
+        """
+        caches = [self._owner(task).cache for task in tasks]
+        # Keep within the smallest token budget of the classes owning the models
+        max_tokens = min(self._owner(task).max_tokens for task in tasks)
+        if all(cache is None for cache in caches):
+            return _run_models(texts, tokenizer, models, max_tokens)
+
+        hashes = [text_hash(text) for text in texts]
+        model_keys = [model_cache_key(model, self._owner(task).backend) for task, model in zip(tasks, models)]
+        cached = [cache.get_many(key, hashes, model.config.num_labels) if cache is not None else [None] * len(texts)
+                  for cache, key, model in zip(caches, model_keys, models)]
+        predictions = [torch.zeros((len(texts), model.config.num_labels)) for model in models]
+        # Texts that occur more than once in the list are only run once
+        missing = {}
+        for idx, hash_value in enumerate(hashes):
+            if any(model_cached[idx] is None for model_cached in cached):
+                missing.setdefault(hash_value, []).append(idx)
+            else:
+                for model_predictions, model_cached in zip(predictions, cached):
+                    model_predictions[idx] = torch.from_numpy(model_cached[idx])
+        if len(missing) == 0:
+            return predictions
+
+        first_idx = [indexes[0] for indexes in missing.values()]
+        missing_preds = _run_models([texts[idx] for idx in first_idx], tokenizer, models, max_tokens)
+        for cache, key, model_cached, model_predictions, model_missing in zip(caches, model_keys, cached,
+                                                                               predictions, missing_preds):
+            if cache is not None:
+                # Only store the predictions that were not already cached for this model
+                new_idx = [pos for pos, idx in enumerate(first_idx) if model_cached[idx] is None]
+                cache.put_many(key, [hashes[first_idx[pos]] for pos in new_idx], model_missing[new_idx].numpy())
+            for indexes, probs in zip(missing.values(), model_missing):
+                model_predictions[indexes] = probs
+        return predictions
+
+    def analyze(self, texts: Union[str, List[str]], tasks=ANALYSIS_TASKS,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, np.ndarray]:
+        """
+        Classifies the texts with the coarse and fine ESG classifiers and analyses their ESG sentiment in one pass.
+        Params:
+            texts: a string or list of strings to be analysed. Each string is analysed separately.
+            tasks: the analyses to run, any of "coarse", "topic" and "sentiment". Default is all of them
+            chunk_size: the number of texts tokenized and run at a time, so that memory use does not grow with the
+                number of texts in long documents
+        Returns:
+            Dictionary of arrays with an entry for each text:
+                - coarse_label, coarse_prob: the most likely broad category (Environmental, Social, Governance or None)
+                  and its probability
+                - topic, topic_prob: the most likely of the 9 ESG topics and its probability
+                - sentiment: the sentiment rescaled into the range -1 (negative) to 1 (positive), see
+                  rescale_sentiment_probabilities
+            Only the entries of the requested tasks are returned.
+
+        Note: the models have a 512 token limit and so texts longer than 512 will be truncated
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        for task in tasks:
+            if task not in ANALYSIS_TASKS:
+                raise ValueError(f"Unknown analysis task '{task}'. Supported tasks are {ANALYSIS_TASKS}")
+
+        groups = self._group_by_tokenizer(tasks)
+        chunk_results = []
+        for chunk in iter_chunks(texts, chunk_size):
+            results = {}
+            for tokenizer, group_tasks, models in groups:
+                self.log.debug(f"Running {group_tasks} on {len(chunk)} texts with a shared tokenization")
+                predictions = self._cached_shared_inference(chunk, tokenizer, group_tasks, models)
+                for task, model, probs in zip(group_tasks, models, predictions):
+                    result = self._owner(task)._order_and_label(probs, model.config.id2label, as_arrays=True)
+                    if task == "sentiment":
+                        results["sentiment"] = rescale_sentiment_probabilities(result.probs)
+                        continue
+                    label_key, prob_key = _RESULT_KEYS[task]
+                    results[label_key], results[prob_key] = result.top_labels()
+            chunk_results.append(results)
+        if len(chunk_results) == 0:
+            return _empty_results(tasks)
+        return {key: np.concatenate([results[key] for results in chunk_results]) for key in chunk_results[0]}
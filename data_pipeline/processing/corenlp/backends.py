@@ -0,0 +1,175 @@
+"""
+Inference backends for the HuggingFace sequence classification models used by the corenlp classes.
+The supported backends are:
+    - torch: the model as published (fp32 PyTorch)
+    - torch-int8: the PyTorch model with its Linear layers dynamically quantized to int8
+    - onnx: the model exported to ONNX and run with ONNX Runtime
+
+The ONNX models are exported once and cached locally. This can be done ahead of time from the processing folder with
+    python -m corenlp.backends export --models yiyanghkust/finbert-esg yiyanghkust/finbert-esg-9-categories
+
+and the agreement of a backend with the torch backend can be checked with
+    python -m corenlp.backends parity --backend onnx --models yiyanghkust/finbert-esg --sample_file ./sample.txt
+"""
+import argparse
+import inspect
+import logging
+import os
+import time
+from types import SimpleNamespace
+from typing import List
+
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+
+from .batching import run_batched_inference
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+DEFAULT_ONNX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "esg_corenlp", "onnx")
+ONNX_OPSET_VERSION = 14
+
+logger = logging.getLogger("corenlp_backends")
+
+
+def _onnx_model_path(model_name: str, cache_dir: str, revision: str = None) -> str:
+    model_dir = model_name.replace("/", "--") if revision is None else f"{model_name.replace('/', '--')}--{revision}"
+    return os.path.join(cache_dir, model_dir, "model.onnx")
+
+
+class OnnxSequenceClassifier:
+    """
+    Runs an ONNX exported sequence classification model with ONNX Runtime.
+    The model is called in the same way as the HuggingFace model and the outputs have a logits tensor,
+    so it can be used in place of the PyTorch model
+    """
+
+    def __init__(self, onnx_path: str, config):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx backend needs the onnxruntime package, install it with "
+                              "pip install onnxruntime") from e
+
+        self.config = config
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_path, session_options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def __call__(self, **inputs):
+        feed = {name: inputs[name].cpu().numpy() for name in self.input_names if name in inputs}
+        logits = self.session.run(["logits"], feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def export_onnx_model(model_name: str, cache_dir: str = DEFAULT_ONNX_CACHE_DIR, overwrite: bool = False,
+                      revision: str = None) -> str:
+    """
+    Exports a HuggingFace sequence classification model to ONNX and caches it locally.
+    Returns the path to the exported model
+    """
+    onnx_path = _onnx_model_path(model_name, cache_dir, revision)
+    if os.path.exists(onnx_path) and not overwrite:
+        return onnx_path
+
+    logger.info(f"Exporting {model_name} to ONNX ({onnx_path})")
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, revision=revision)
+    model.eval()
+
+    sample = tokenizer(["Sample text used to trace the model", "Sample"], padding=True, return_tensors='pt')
+    # The inputs of the exported graph are in the order of the model's forward arguments, not the tokenizer outputs
+    input_names = [name for name in inspect.signature(model.forward).parameters if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    export_args = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Newer versions of torch default to the dynamo exporter, the TorchScript exporter supports dynamic_axes
+        export_args["dynamo"] = False
+    with torch.inference_mode():
+        torch.onnx.export(model, (dict(sample),), onnx_path, input_names=input_names, output_names=["logits"],
+                          dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET_VERSION, **export_args)
+    return onnx_path
+
+
+def load_sequence_classifier(model_name: str, backend: str = "torch", cache_dir: str = DEFAULT_ONNX_CACHE_DIR,
+                             revision: str = None):
+    """
+    Loads the tokenizer and model for a HuggingFace sequence classification model using the given backend.
+    For the onnx backend the model is exported on first use if it is not already in the cache.
+    revision is the branch, tag or commit of the model on the HuggingFace Hub, the default branch if None.
+    Returns:
+        The tokenizer and model. The model is called with the tokenized inputs and returns outputs with a logits tensor
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Supported backends are {BACKENDS}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+    if backend == "onnx":
+        onnx_path = export_onnx_model(model_name, cache_dir, revision=revision)
+        return tokenizer, OnnxSequenceClassifier(onnx_path, AutoConfig.from_pretrained(model_name, revision=revision))
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, revision=revision)
+    model.eval()
+    if backend == "torch-int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model
+
+
+def check_backend_parity(model_name: str, backend: str, texts: List[str],
+                         cache_dir: str = DEFAULT_ONNX_CACHE_DIR) -> dict:
+    """
+    Compares the predictions of a backend with the torch backend over a sample of texts.
+    Returns the fraction of texts where the top label agrees, the largest difference in probability and the speedup
+    """
+    results = {"model": model_name, "backend": backend, "num_texts": len(texts)}
+    predictions = {}
+    for name in ("torch", backend):
+        tokenizer, model = load_sequence_classifier(model_name, name, cache_dir)
+        # Warm up so that one-off initialisation is not timed
+        run_batched_inference(texts[:1], tokenizer, model)
+        start = time.perf_counter()
+        predictions[name] = run_batched_inference(texts, tokenizer, model)
+        results[f"{name}_seconds"] = time.perf_counter() - start
+
+    results["label_agreement"] = (predictions["torch"].argmax(dim=-1) ==
+                                  predictions[backend].argmax(dim=-1)).float().mean().item()
+    results["max_prob_difference"] = (predictions["torch"] - predictions[backend]).abs().max().item()
+    results["speedup"] = results["torch_seconds"] / max(results[f"{backend}_seconds"], 1e-9)
+    return results
+
+
+if __name__ == '__main__':
+    logging.basicConfig(encoding='utf-8', level=logging.INFO)
+    default_models = ["yiyanghkust/finbert-esg", "yiyanghkust/finbert-esg-9-categories", "TrajanovRisto/bert-esg"]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["export", "parity"],
+                        help="'export' converts the models to ONNX and caches them, "
+                             "'parity' compares a backend against the torch backend")
+    parser.add_argument("--models", nargs="+", default=default_models,
+                        help="The HuggingFace models to export or check. Default is the corenlp classification models")
+    parser.add_argument("--backend", type=str, default="onnx", choices=BACKENDS,
+                        help="The backend to compare against the torch backend. Default onnx")
+    parser.add_argument("--sample_file", type=str, default=None,
+                        help="Text file with one sample text per line used for the parity check")
+    parser.add_argument("--cache_dir", type=str, default=DEFAULT_ONNX_CACHE_DIR,
+                        help=f"The folder where the ONNX models are cached. Default {DEFAULT_ONNX_CACHE_DIR}")
+    parser.add_argument("--overwrite", action="store_true", help="Re-export models that are already cached")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for name in args.models:
+            logger.info(f"Exported {name} to {export_onnx_model(name, args.cache_dir, args.overwrite)}")
+    else:
+        if args.sample_file is None or not os.path.exists(args.sample_file):
+            raise RuntimeError(f"The sample file could not be found. Path was '{args.sample_file}'")
+        with open(args.sample_file) as f:
+            sample_texts = [line.strip() for line in f if len(line.strip()) > 0]
+        for name in args.models:
+            parity = check_backend_parity(name, args.backend, sample_texts, args.cache_dir)
+            logger.info(f"{name} [{parity['backend']}]: label agreement {parity['label_agreement']:.2%}, "
+                        f"max probability difference {parity['max_prob_difference']:.5f}, "
+                        f"speedup {parity['speedup']:.2f}x over {parity['num_texts']} texts")
@@ -0,0 +1,113 @@
+"""
+Length bucketed dynamic batching for HuggingFace sequence classification models.
+Tokenizing a list of texts with padding=True pads every text to the length of the longest text, so a single long
+paragraph makes the model compute attention over padding for every other text in the list.
+The texts are instead sorted by their token length and packed into batches of similar length under a budget of
+tokens per batch; the predictions are returned in the original order of the texts.
+"""
+from typing import List, Union
+
+import torch
+
+DEFAULT_MAX_TOKENS = 16384
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_CHUNK_SIZE = 256
+
+
+def length_bucketed_batches(lengths: List[int], max_tokens: int = DEFAULT_MAX_TOKENS,
+                            max_batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> List[List[int]]:
+    """
+    Groups the indexes of the inputs into batches of inputs with similar lengths.
+    The padded size of each batch (number of inputs x longest input) is kept within max_tokens,
+    although an input longer than max_tokens is still given a batch of its own
+    """
+    order = sorted(range(len(lengths)), key=lambda idx: lengths[idx])
+    batches = []
+    batch = []
+    for idx in order:
+        # Inputs are in ascending length order so the current input is the longest in the batch
+        if len(batch) > 0 and (len(batch) + 1 > max_batch_size or (len(batch) + 1) * lengths[idx] > max_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def _pad_batch(encodings, batch: List[int], tokenizer) -> dict:
+    """Pads the tokenized inputs of a batch to the length of the longest input and returns them as tensors"""
+    max_len = max(len(encodings["input_ids"][idx]) for idx in batch)
+    pad_values = {"input_ids": tokenizer.pad_token_id, "token_type_ids": tokenizer.pad_token_type_id}
+    tok_inputs = {}
+    for key in encodings.keys():
+        pad_value = pad_values.get(key, 0)
+        rows = []
+        for idx in batch:
+            row = encodings[key][idx]
+            padding = [pad_value] * (max_len - len(row))
+            rows.append(padding + row if tokenizer.padding_side == "left" else row + padding)
+        tok_inputs[key] = torch.tensor(rows)
+    return tok_inputs
+
+
+def run_batched_inference(texts: Union[str, List[str]], tokenizer, model, max_length: int = 512,
+                          max_tokens: int = DEFAULT_MAX_TOKENS,
+                          max_batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> torch.Tensor:
+    """
+    Runs a sequence classification model over the texts in length bucketed batches.
+    Params:
+        texts: a string or list of strings to be classified
+        tokenizer, model: the HuggingFace tokenizer and sequence classification model
+        max_length: the maximum number of tokens of each text, longer texts are truncated.
+            If None, the maximum length of the tokenizer is used
+        max_tokens: the maximum number of (padded) tokens in each batch
+        max_batch_size: the maximum number of texts in each batch
+    Returns:
+        Tensor of the softmax probabilities of each label for each text (texts x labels), in the order of the texts
+    """
+    return run_shared_batched_inference(texts, tokenizer, [model], max_length, max_tokens, max_batch_size)[0]
+
+
+def run_shared_batched_inference(texts: Union[str, List[str]], tokenizer, models: List, max_length: int = 512,
+                                 max_tokens: int = DEFAULT_MAX_TOKENS,
+                                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> List[torch.Tensor]:
+    """
+    Runs several sequence classification models that share the same tokenizer over the texts.
+    The texts are tokenized once and each batch of tensors is passed to every model in turn.
+    Params:
+        texts: a string or list of strings to be classified
+        tokenizer: the HuggingFace tokenizer shared by the models
+        models: the HuggingFace sequence classification models
+        max_length, max_tokens, max_batch_size: see run_batched_inference
+    Returns:
+        List with a tensor of softmax probabilities (texts x labels) for each model, in the order of the models
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    predictions = [torch.zeros((len(texts), model.config.num_labels)) for model in models]
+    if len(texts) == 0:
+        return predictions
+
+    encodings = tokenizer(texts, truncation=True, max_length=max_length, padding=False)
+    lengths = [len(input_ids) for input_ids in encodings["input_ids"]]
+
+    with torch.inference_mode():
+        for batch in length_bucketed_batches(lengths, max_tokens, max_batch_size):
+            tok_inputs = _pad_batch(encodings, batch, tokenizer)
+            batch_idx = torch.tensor(batch)
+            for model, model_predictions in zip(models, predictions):
+                outputs = model(**tok_inputs)
+                model_predictions[batch_idx] = torch.nn.functional.softmax(outputs.logits, dim=-1)
+    return predictions
+
+
+def iter_chunks(texts: Union[str, List[str]], chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Splits the texts into consecutive chunks of at most chunk_size texts, so that long documents can be processed
+    (tokenized, classified and post processed) a chunk at a time with memory that does not grow with their length
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    for start in range(0, len(texts), chunk_size):
+        yield texts[start:start + chunk_size]
@@ -1,7 +1,11 @@
-from typing import List
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from typing import List, Union
+from .backends import BACKENDS
+from .batching import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_TOKENS, iter_chunks, run_batched_inference
+from .inference_service import InferenceClient, RemoteSequenceClassifier
+from .result_cache import ResultCache, cached_inference, model_cache_key
+from .registry import acquire_sequence_classifier, release_sequence_classifier
+from .results import ClassificationResult, label_vocabulary
 import logging
-import torch
 
 
 class EsgTextClassification:
@@ -10,10 +14,24 @@ class EsgTextClassification:
     The class uses a set of HuggingFace Transformer models to perform the classification.
     These models are lazy loaded (i.e. they are only loaded if used) and consequently the first call to classify
     text will take some time to complete but subsequent calls will be quicker since the model is already loaded.
+    The backend used to run the models can be 'torch' (default), 'torch-int8' or 'onnx' (see backends.py).
+    Predictions can be cached across calls and runs by passing a ResultCache (see result_cache.py).
+    If service_url is given, the models are run by the local inference service (see inference_service.py)
+    rather than being loaded by the class.
     """
 
-    def __init__(self, lazy_load=True):
+    def __init__(self, lazy_load=True, backend="torch", cache: ResultCache = None, service_url: str = None,
+                 max_tokens: int = DEFAULT_MAX_TOKENS):
         self.log = logging.getLogger("EsgTextClassification")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}'. Supported backends are {BACKENDS}")
+        self.backend = backend
+        # The maximum number of (padded) tokens run through a model at once, which bounds the activation memory
+        self.max_tokens = max_tokens
+        # Optional cache of the predictions so that repeated texts are not run through the models again
+        self.cache = cache
+        self._acquired_models = []
+        self.service_client = InferenceClient(service_url) if service_url is not None else None
 
         # Model that is used to perform course grain document classification (ESG  or not)
         self.esg_course_classifier_model_name = "yiyanghkust/finbert-esg"
@@ -31,43 +49,64 @@ class EsgTextClassification:
 
     def _load_esg_course_classifier(self):
         self.log.info("Loading ESG Course Grained Text Classifier")
-        self.esg_course_classifier_tokenizer = AutoTokenizer.from_pretrained(self.esg_course_classifier_model_name)
-        self.esg_course_classifier_model = AutoModelForSequenceClassification.from_pretrained(
+        self.esg_course_classifier_tokenizer, self.esg_course_classifier_model = self._load_model(
             self.esg_course_classifier_model_name)
 
+    def _load_model(self, model_name):
+        if self.service_client is not None:
+            # In client mode there is no local tokenizer, the texts are sent to the inference service
+            return None, RemoteSequenceClassifier(self.service_client, model_name)
+        # Models are shared through the registry with any other instance or class using the same model
+        self._acquired_models.append(model_name)
+        return acquire_sequence_classifier(model_name, self.backend)
+
     @staticmethod
-    def _order_and_label(logits, labels) -> List:
-        ordered_preds = []
-        for res in logits:
-            sample_preds = []
-            for idx, prob in enumerate(res):
-                sample_preds.append({"label": labels[idx], "prob": prob.item()})
-            ordered_preds.append(sorted(sample_preds, key=lambda x: x['prob'], reverse=True))
-        return ordered_preds
+    def _order_and_label(logits, labels, as_arrays=False):
+        # The labels are ranked over the whole probability matrix rather than sorting a list of dicts per text
+        result = ClassificationResult(logits, label_vocabulary(labels))
+        return result if as_arrays else result.to_label_dicts()
 
-    def _course_classifier_post_processing(self, logits) -> List:
-        return self._order_and_label(logits, self.esg_course_classifier_model.config.id2label)
+    def _course_classifier_post_processing(self, logits, as_arrays=False):
+        return self._order_and_label(logits, self.esg_course_classifier_model.config.id2label, as_arrays)
 
-    def _fine_classifier_post_processing(self, logits):
-        return (self._order_and_label(logits, self.esg_fine_classifier_model.config.id2label))
+    def _fine_classifier_post_processing(self, logits, as_arrays=False):
+        return self._order_and_label(logits, self.esg_fine_classifier_model.config.id2label, as_arrays)
 
     def _load_esg_fine_classifier(self):
         self.log.info("Loading ESG Fine Grained Text Classifier")
-        self.esg_fine_classifier_tokenizer = AutoTokenizer.from_pretrained(self.esg_fine_classifier_model_name)
-        self.esg_fine_classifier_model = AutoModelForSequenceClassification.from_pretrained(
+        self.esg_fine_classifier_tokenizer, self.esg_fine_classifier_model = self._load_model(
             self.esg_fine_classifier_model_name)
 
+    def release_models(self, unload=False):
+        """
+        Releases the models used by the instance so that they can be unloaded from the model registry.
+        If unload is True, models that are not used by any other instance are unloaded.
+        The models are loaded again if the instance is used afterwards
+        """
+        for model_name in self._acquired_models:
+            release_sequence_classifier(model_name, self.backend, unload=unload)
+        self._acquired_models.clear()
+        self.esg_course_classifier_tokenizer = None
+        self.esg_course_classifier_model = None
+        self.esg_fine_classifier_tokenizer = None
+        self.esg_fine_classifier_model = None
+
     def _do_inference(self, texts, tokenizer, model):
         """ Performs inference using a huggingface model and tokenizer and returns the predictions"""
 
         # Normally for the tokenizer you don't need to specify the max length since it is defined for tokenizer
         # but the Finbert models, this has not been set but the BERT models only accepts 512
-        tok_inputs = tokenizer(texts, padding=True, truncation=True, max_length=512, return_tensors='pt')
-        outputs = model(**tok_inputs)
-        predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
-        return predictions
-
-    def is_esg_related(self, text: str) -> List:
+        # Texts are batched by token length so that short texts are not padded to the length of the longest text
+        # Texts with a cached prediction are not tokenized or passed to the model
+        if isinstance(model, RemoteSequenceClassifier):
+            run_inference = model.predict
+        else:
+            run_inference = lambda batch: run_batched_inference(batch, tokenizer, model, max_length=512,
+                                                                max_tokens=self.max_tokens)
+        return cached_inference(self.cache, model_cache_key(model, self.backend), texts, model.config.num_labels,
+                                run_inference)
+
+    def is_esg_related(self, text: str, as_arrays=False) -> Union[List, ClassificationResult]:
         """
         Function to categorise text into one of 4 categories:
             - Environmental
@@ -76,21 +115,24 @@ class EsgTextClassification:
             - None
         Params:
             text: a string or list of strings to be classified. Each string is classified seperately.
+            as_arrays: if True, the classifications are returned as a ClassificationResult (see results.py)
 
         Returns:
             List containing the classification for each input text.
             Each classification is an ordered list of dictionary objects (Label and Score).
+            If as_arrays is True, a ClassificationResult with the (texts x labels) probabilities and the labels.
 
         Note: the model has a 512 token limit and so texts longer than 512 will be truncated during the
          classification process
        """
 
-        if self.esg_course_classifier_tokenizer is None or self.esg_course_classifier_model is None:
+        if self.esg_course_classifier_model is None:
             self._load_esg_course_classifier()
         return self._course_classifier_post_processing(
-            self._do_inference(text, self.esg_course_classifier_tokenizer, self.esg_course_classifier_model))
+            self._do_inference(text, self.esg_course_classifier_tokenizer, self.esg_course_classifier_model),
+            as_arrays)
 
-    def get_esg_topic(self, text) -> List:
+    def get_esg_topic(self, text, as_arrays=False) -> Union[List, ClassificationResult]:
         """
         Function to categorise text into one of a set of ESG Topics.
         The current class uses the FinBert-ESG-9-Categories transformer so for each input text will an order list of
@@ -110,16 +152,34 @@ class EsgTextClassification:
             text: a string or list of strings to be classified. Each string is classified separately.
             This method is best called on sentences or paragraphs containing related content
             (e.g. all sentences relate to Pollution) - otherwise, the strength of the signal for the ESG topic is reduced.
+            as_arrays: if True, the classifications are returned as a ClassificationResult (see results.py)
 
         Returns:
             List containing the classification for each input text.
             Each classification is an ordered list of dictionary objects (Label and Score).
+            If as_arrays is True, a ClassificationResult with the (texts x labels) probabilities and the labels.
 
         Note: the model has a 512 token limit and so texts longer than 512 will be truncated during the
          classification process
        """
 
-        if self.esg_fine_classifier_tokenizer is None or self.esg_fine_classifier_model is None:
+        if self.esg_fine_classifier_model is None:
             self._load_esg_fine_classifier()
         return self._fine_classifier_post_processing(
-            self._do_inference(text, self.esg_fine_classifier_tokenizer, self.esg_fine_classifier_model))
+            self._do_inference(text, self.esg_fine_classifier_tokenizer, self.esg_fine_classifier_model), as_arrays)
+
+    def iter_esg_topic(self, texts, chunk_size: int = DEFAULT_CHUNK_SIZE, as_arrays=False):
+        """
+        Generator version of get_esg_topic for long documents.
+        The texts are processed chunk_size texts at a time and the ESG topic classification of each chunk is yielded as soon as it
+        is ready, so memory use does not grow with the number of texts.
+        Params:
+            texts: a string or list of strings to be classified. Each string is classified separately.
+            chunk_size: the number of texts processed at a time
+            as_arrays: if True, each chunk is yielded as a ClassificationResult (see results.py)
+
+        Yields:
+            The result of get_esg_topic for each chunk of texts, in the order of the texts
+        """
+        for chunk in iter_chunks(texts, chunk_size):
+            yield self.get_esg_topic(chunk, as_arrays)
@@ -0,0 +1,102 @@
+"""
+Entity and keyword extraction from a single parse of each document.
+Extracting the entities with EntityExtractor and then the keywords with EsgKeywordExtractor parses a document twice,
+once with the NER pipeline and once (after removing the entities from the text) with en_core_web_sm. DocumentAnalysis
+runs the NER pipeline once with the components needed by both (the entity recogniser and the tagger/lemmatizer used
+by textrank). The entities are read from the doc and the tokens of the terms to ignore are masked out of the same doc
+before the textrank keywords are extracted, rather than removed from the text and the text parsed again.
+"""
+import itertools
+from typing import Iterable, Iterator, List
+
+from spacy.tokens import Doc
+
+from .keywords import DEFAULT_PIPE_BATCH_SIZE, TEXTRANK_PIPES, EsgKeywordExtractor
+from .named_entity_extraction import ENTITY_PIPES, EntityExtractor, disabled_pipes
+from .term_matching import TermTrie
+
+
+def mask_doc(doc: Doc, ignore_terms: Iterable[str]) -> Doc:
+    """
+    Returns a doc without the tokens of the terms to ignore, keeping the POS tags and lemmas of the other tokens.
+    The terms are matched as whole words, ignoring case, and a partly matched token is masked
+    """
+    masked = [False] * len(doc)
+    for start, end, _ in TermTrie(ignore_terms).find_all(doc.text):
+        span = doc.char_span(start, end, alignment_mode="expand")
+        if span is not None:
+            masked[span.start:span.end] = [True] * len(span)
+    if not any(masked):
+        return doc
+
+    tokens = [token for token in doc if not masked[token.i]]
+    annotations = {}
+    if doc.has_annotation("TAG"):
+        annotations["tags"] = [token.tag_ for token in tokens]
+    if doc.has_annotation("POS"):
+        annotations["pos"] = [token.pos_ for token in tokens]
+    if doc.has_annotation("LEMMA"):
+        annotations["lemmas"] = [token.lemma_ for token in tokens]
+    return Doc(doc.vocab, words=[token.text for token in tokens],
+               spaces=[len(token.whitespace_) > 0 for token in tokens], **annotations)
+
+
+class DocumentAnalysis:
+    """
+    Extracts the entities and the ESG keywords of documents from one parse of each document.
+    Params:
+        entity_extractor: the EntityExtractor, whose spaCy pipeline is used to parse the documents
+        keyword_extractor: the EsgKeywordExtractor used to filter and cluster the keywords
+    """
+
+    def __init__(self, entity_extractor: EntityExtractor, keyword_extractor: EsgKeywordExtractor):
+        self.entity_extractor = entity_extractor
+        self.keyword_extractor = keyword_extractor
+        self.nlp = entity_extractor.nlp
+        # Only the components needed for the entities and for textrank are run
+        self.disabled_pipes = disabled_pipes(self.nlp, ENTITY_PIPES + TEXTRANK_PIPES)
+
+    def _parse_many(self, texts: Iterable[str], ignore_terms: Iterable[List[str]], top_n: int, batch_size: int,
+                    n_process: int) -> Iterator[tuple]:
+        """Generates the entities and the textrank keywords of each text"""
+        for doc, doc_ignore_terms in zip(self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process,
+                                                       disable=self.disabled_pipes), ignore_terms):
+            entities = self.entity_extractor.entities_from_doc(doc)
+            # The entities are ignored when extracting the keywords, as well as the given terms
+            terms = set(doc_ignore_terms or [])
+            for entity in entities.values():
+                terms.update(entity)
+            yield entities, self.keyword_extractor.textrank_terms(mask_doc(doc, terms), top_n)
+
+    def analyze_many(self, texts: Iterable[str], ignore_terms: Iterable[List[str]] = None,
+                     filter_non_esg_keywords: bool = True, top_n: int = 10, batch_size: int = DEFAULT_PIPE_BATCH_SIZE,
+                     n_process: int = 1) -> Iterator[dict]:
+        """
+        Generates the entities and ESG keywords of each of a stream of texts, in the same order as the texts.
+        Each result is a dictionary with the "entities" (see EntityExtractor.extract_entities) and the "keywords"
+        (see EsgKeywordExtractor.get_esg_keywords) of the text.
+        Params:
+            texts: the texts, which can be a generator
+            ignore_terms: the list of terms to ignore when extracting the keywords of each text (in addition to the
+                entities of the text), or None
+            filter_non_esg_keywords: whether to remove the keywords that FinBERT-ESG does not classify as ESG
+            top_n: the number of Text Rank keywords extracted from each text before filtering and clustering
+            batch_size: the number of texts parsed by spaCy in each batch
+            n_process: the number of processes used by spaCy to parse the texts
+        """
+        if ignore_terms is None:
+            ignore_terms = itertools.repeat(None)
+        parsed = self._parse_many(texts, ignore_terms, top_n, batch_size, n_process)
+        while True:
+            batch = list(itertools.islice(parsed, batch_size))
+            if len(batch) == 0:
+                break
+            keyword_lists = self.keyword_extractor.filter_and_cluster_keywords_many(
+                [keywords for _, keywords in batch], filter_non_esg_keywords)
+            for (entities, _), keywords in zip(batch, keyword_lists):
+                yield {"entities": entities, "keywords": keywords}
+
+    def analyze(self, text: str, ignore_terms: List[str] = None, filter_non_esg_keywords: bool = True,
+                top_n: int = 10) -> dict:
+        """Returns the entities and ESG keywords of a text, see analyze_many"""
+        return next(self.analyze_many([text], [ignore_terms], filter_non_esg_keywords, top_n))
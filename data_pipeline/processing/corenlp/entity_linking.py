@@ -0,0 +1,129 @@
+"""
+Links organisation mentions to the organisations of the insights database.
+Every alias in the organisations_alias table is normalised (legal suffixes such as Ltd or Inc removed with cleanco)
+and added to an in-memory TermTrie, so the organisations mentioned in an ORG entity or in a whole text are found in a
+single pass over the text rather than with a fuzzy SQL lookup per mention. The trie is updated incrementally with the
+aliases that were added, changed or removed since it was last refreshed.
+"""
+import logging
+import sqlite3
+from typing import Dict, Iterable, List, Set, Tuple
+
+from cleanco import basename
+
+from .term_matching import TermTrie
+
+# Shorter aliases (e.g. initials) match too many unrelated words
+MIN_ALIAS_LENGTH = 2
+# Aliases shorter than this (e.g. BP, GE, HP) only link a mention that is the whole alias, not one that contains it
+MIN_SUBSTRING_ALIAS_LENGTH = 4
+
+
+def normalize_org_name(name: str) -> str:
+    """Returns the name of an organisation without its legal suffix (Ltd, Inc, plc ...) and with normalised spaces"""
+    name = " ".join(name.split())
+    # basename returns an empty string for names that are only a legal term, those are kept as they are
+    return " ".join(basename(name).split()) or name
+
+
+class OrganisationLinker:
+    """
+    Index of the organisation aliases used to find the ids of the organisations mentioned in a text.
+    Params:
+        conn: connection to the insights database. If given, the aliases are loaded from the organisations_alias table
+        min_alias_length: aliases shorter than this (after normalisation) are not matched
+        min_substring_alias_length: aliases shorter than this only link an ORG mention that is the whole alias
+    """
+
+    def __init__(self, conn: sqlite3.Connection = None, min_alias_length: int = MIN_ALIAS_LENGTH,
+                 min_substring_alias_length: int = MIN_SUBSTRING_ALIAS_LENGTH):
+        self.log = logging.getLogger("OrganisationLinker")
+        self.min_alias_length = min_alias_length
+        self.min_substring_alias_length = min_substring_alias_length
+        self.trie = TermTrie()
+        # alias row id -> (org id, normalised alias) of the aliases in the trie
+        self._alias_rows: Dict[int, Tuple[int, str]] = {}
+        # normalised alias (lower case) -> the ids of the alias rows that have the alias, for each org id
+        self._alias_orgs: Dict[str, Dict[int, Set[int]]] = {}
+        if conn is not None:
+            self.refresh(conn)
+
+    def refresh(self, conn: sqlite3.Connection) -> int:
+        """
+        Updates the index with the aliases that were added, changed or removed in the organisations_alias table since
+        the last refresh. Returns the number of alias rows that changed
+        """
+        cur = conn.cursor()
+        cur.execute("SELECT id, org_id, alias FROM organisations_alias")
+        rows = {row_id: (org_id, normalize_org_name(alias)) for row_id, org_id, alias in cur.fetchall()
+                if alias is not None}
+        cur.close()
+
+        removed = [row_id for row_id, row in self._alias_rows.items() if rows.get(row_id) != row]
+        added = [(row_id, row) for row_id, row in rows.items() if self._alias_rows.get(row_id) != row]
+        for row_id in removed:
+            self._remove_alias(row_id)
+        for row_id, (org_id, alias) in added:
+            self._add_alias(row_id, org_id, alias)
+        if len(removed) > 0 or len(added) > 0:
+            self.log.info(f"Organisation aliases updated: {len(added)} added or changed, {len(removed)} removed. "
+                          f"{len(self.trie)} aliases indexed")
+        return len(set(removed) | {row_id for row_id, _ in added})
+
+    def add_aliases(self, aliases: Iterable[Tuple[int, int, str]]):
+        """Adds (alias row id, org id, alias) rows to the index"""
+        for row_id, org_id, alias in aliases:
+            if row_id in self._alias_rows:
+                self._remove_alias(row_id)
+            self._add_alias(row_id, org_id, normalize_org_name(alias))
+
+    def _add_alias(self, row_id: int, org_id: int, alias: str):
+        self._alias_rows[row_id] = (org_id, alias)
+        if len(alias) < self.min_alias_length:
+            return
+        orgs = self._alias_orgs.setdefault(alias.lower(), {})
+        orgs.setdefault(org_id, set()).add(row_id)
+        self.trie.add(alias, value=tuple(sorted(orgs)))
+
+    def _remove_alias(self, row_id: int):
+        org_id, alias = self._alias_rows.pop(row_id)
+        orgs = self._alias_orgs.get(alias.lower())
+        if orgs is None or org_id not in orgs:
+            return
+        orgs[org_id].discard(row_id)
+        if len(orgs[org_id]) == 0:
+            del orgs[org_id]
+        if len(orgs) == 0:
+            del self._alias_orgs[alias.lower()]
+            self.trie.remove(alias)
+        else:
+            self.trie.add(alias, value=tuple(sorted(orgs)))
+
+    def find_organisations(self, text: str) -> List[Tuple[int, int, Tuple[int, ...]]]:
+        """
+        Returns the (start, end, org ids) of each alias found in the text.
+        An alias shared by several organisations gives the ids of all of them
+        """
+        return self.trie.find_all(text)
+
+    def link_mention(self, mention: str) -> Tuple[int, ...]:
+        """
+        Returns the ids of the organisations an ORG mention refers to, or an empty tuple if it is not linked.
+        The normalised mention is looked up as a whole first, then the aliases of at least min_substring_alias_length
+        characters contained in the mention are used
+        """
+        org_ids = self.trie.get(normalize_org_name(mention))
+        if org_ids is not None:
+            return org_ids
+        found = {org_id for start, end, ids in self.find_organisations(mention)
+                 if end - start >= self.min_substring_alias_length for org_id in ids}
+        return tuple(sorted(found))
+
+    def link_mentions(self, mentions: Iterable[str]) -> Dict[str, Tuple[int, ...]]:
+        """Returns the org ids of each of the ORG mentions that are linked to at least one organisation"""
+        links = {}
+        for mention in mentions:
+            org_ids = self.link_mention(mention)
+            if len(org_ids) > 0:
+                links[mention] = org_ids
+        return links
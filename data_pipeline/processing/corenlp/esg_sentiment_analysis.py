@@ -1,16 +1,60 @@
-import torch
 import logging
-from typing import List
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from functools import lru_cache
+from typing import List, Union
+
+import numpy as np
+
+from .backends import BACKENDS
+from .batching import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_TOKENS, iter_chunks, run_batched_inference
+from .inference_service import InferenceClient, RemoteSequenceClassifier
+from .result_cache import ResultCache, cached_inference, model_cache_key
+from .registry import acquire_sequence_classifier, release_sequence_classifier
+from .results import ClassificationResult, label_vocabulary
+
+SENTIMENT_LABELS = ["Positive", "Neutral", "Negative"]
+
+
+def sentiment_label_mapping(labels) -> np.ndarray:
+    """
+    Returns the (model labels x SENTIMENT_LABELS) matrix that maps the 9 detailed labels of the sentiment model
+    onto the 3 sentiments, so that the sentiment probabilities are the model probabilities multiplied by the matrix
+    """
+    mapping = np.zeros((len(labels), len(SENTIMENT_LABELS)), dtype=np.float32)
+    for idx in range(len(labels)):
+        for sent_idx, sentiment in enumerate(SENTIMENT_LABELS):
+            if sentiment in labels[idx]:
+                mapping[idx, sent_idx] = 1.0
+                break
+    return mapping
+
+
+@lru_cache(maxsize=None)
+def _cached_label_mapping(labels: tuple) -> np.ndarray:
+    return sentiment_label_mapping(labels)
+
 
 class EsgSentimentAnalysis:
     """
     Performs sentiment analysis on esg texts
     The class uses a HuggingFace Transformer models to perform the sentiment analysis.
+    The backend used to run the model can be 'torch' (default), 'torch-int8' or 'onnx' (see backends.py).
+    Predictions can be cached across calls and runs by passing a ResultCache (see result_cache.py).
+    If service_url is given, the model is run by the local inference service (see inference_service.py)
+    rather than being loaded by the class.
     """
 
-    def __init__(self, lazy_load=True):
+    def __init__(self, lazy_load=True, backend="torch", cache: ResultCache = None, service_url: str = None,
+                 max_tokens: int = DEFAULT_MAX_TOKENS):
         self.log = logging.getLogger("EsgTextSentimentAnalysis")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}'. Supported backends are {BACKENDS}")
+        self.backend = backend
+        # The maximum number of (padded) tokens run through a model at once, which bounds the activation memory
+        self.max_tokens = max_tokens
+        # Optional cache of the predictions so that repeated texts are not run through the models again
+        self.cache = cache
+        self._model_acquired = False
+        self.service_client = InferenceClient(service_url) if service_url is not None else None
 
         # HuggingFace Transformer model
         self.esg_sentiment_analysis_model_name = "TrajanovRisto/bert-esg"
@@ -23,40 +67,53 @@ class EsgSentimentAnalysis:
     def _load_esg_sentiment_analysis(self):
         # Load the model
         self.log.info("Loading ESG Sentiment Analysis Model")
-        self.esg_sentiment_analysis_tokenizer = AutoTokenizer.from_pretrained(self.esg_sentiment_analysis_model_name)
-        self.esg_sentiment_analysis_model = AutoModelForSequenceClassification.from_pretrained(self.esg_sentiment_analysis_model_name)
+        if self.service_client is not None:
+            # In client mode there is no local tokenizer, the texts are sent to the inference service
+            self.esg_sentiment_analysis_model = RemoteSequenceClassifier(self.service_client,
+                                                                         self.esg_sentiment_analysis_model_name)
+            return
+        # The model is shared through the registry with any other instance using the same model
+        self.esg_sentiment_analysis_tokenizer, self.esg_sentiment_analysis_model = acquire_sequence_classifier(
+            self.esg_sentiment_analysis_model_name, self.backend)
+        self._model_acquired = True
+
+    def release_models(self, unload=False):
+        """
+        Releases the model used by the instance so that it can be unloaded from the model registry.
+        If unload is True and the model is not used by any other instance, it is unloaded.
+        The model is loaded again if the instance is used afterwards
+        """
+        if self._model_acquired:
+            release_sequence_classifier(self.esg_sentiment_analysis_model_name, self.backend, unload=unload)
+            self._model_acquired = False
+        self.esg_sentiment_analysis_tokenizer = None
+        self.esg_sentiment_analysis_model = None
 
     @staticmethod
-    def _order_and_label(logits, labels) -> List:
+    def _order_and_label(logits, labels, as_arrays=False):
         # Output the sentiment and change the output from 9 labels into 3 labels (Positive, Neutral, Negative) and the probability of each labels
-        ordered_preds = []
-        for res in logits:
-            sample_preds = [{'Positive': 0.0, 'Neutral': 0.0, 'Negative': 0.0}]
-            for idx, prob in enumerate(res):
-                detailed_label = labels[idx]
-
-                if 'Positive' in detailed_label:
-                    sample_preds[0]['Positive'] += prob.item()
-                elif 'Neutral' in detailed_label:
-                    sample_preds[0]['Neutral'] += prob.item()
-                elif 'Negative' in detailed_label:
-                    sample_preds[0]['Negative'] += prob.item()
-
-            ordered_preds.append(sorted(sample_preds[0].items(), key=lambda x: x[1], reverse=True))
-        return ordered_preds
-
-    def _sentiment_analysis_post_processing(self, logits) -> List:
-        return self._order_and_label(logits, self.esg_sentiment_analysis_model.config.id2label)
-    
+        # The 9 label probabilities are combined with a single multiply by the label mapping matrix
+        labels = tuple(label_vocabulary(labels))
+        result = ClassificationResult(logits, labels).map_labels(_cached_label_mapping(labels), SENTIMENT_LABELS)
+        return result if as_arrays else result.to_label_tuples()
+
+    def _sentiment_analysis_post_processing(self, logits, as_arrays=False):
+        return self._order_and_label(logits, self.esg_sentiment_analysis_model.config.id2label, as_arrays)
+
     def _do_inference(self, texts, tokenizer, model):
         """ Performs inference using a huggingface model and tokenizer and returns the predictions"""
 
-        tok_inputs = tokenizer(texts, padding=True, truncation=True, max_length=512, return_tensors='pt')
-        outputs = model(**tok_inputs)
-        predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
-        return predictions
+        # Texts are batched by token length so that short texts are not padded to the length of the longest text
+        # Texts with a cached prediction are not tokenized or passed to the model
+        if isinstance(model, RemoteSequenceClassifier):
+            run_inference = model.predict
+        else:
+            run_inference = lambda batch: run_batched_inference(batch, tokenizer, model, max_length=512,
+                                                                max_tokens=self.max_tokens)
+        return cached_inference(self.cache, model_cache_key(model, self.backend), texts, model.config.num_labels,
+                                run_inference)
     
-    def get_esg_sentiment(self, text: str) -> List:
+    def get_esg_sentiment(self, text: str, as_arrays=False) -> Union[List, ClassificationResult]:
         """
         Function to categorise text into one of 3 sentiments:
             - Positive
@@ -64,13 +121,32 @@ class EsgSentimentAnalysis:
             - Negative
         Params:
             text: a string or list of strings to be analyze.
+            as_arrays: if True, the sentiments are returned as a ClassificationResult (see results.py)
 
         Returns:
             List containing the sentiment for each input text.
             Each sentiment is an ordered list of dictionary objects (Sentiments and Scores).
+            If as_arrays is True, a ClassificationResult with the (texts x SENTIMENT_LABELS) probabilities.
        """
 
-        if self.esg_sentiment_analysis_tokenizer is None or self.esg_sentiment_analysis_model is None:
+        if self.esg_sentiment_analysis_model is None:
             self._load_esg_sentiment_analysis()
         return self._sentiment_analysis_post_processing(
-            self._do_inference(text, self.esg_sentiment_analysis_tokenizer, self.esg_sentiment_analysis_model))
\ No newline at end of file
+            self._do_inference(text, self.esg_sentiment_analysis_tokenizer, self.esg_sentiment_analysis_model),
+            as_arrays)
+
+    def iter_esg_sentiment(self, texts, chunk_size: int = DEFAULT_CHUNK_SIZE, as_arrays=False):
+        """
+        Generator version of get_esg_sentiment for long documents.
+        The texts are processed chunk_size texts at a time and the sentiment of each chunk is yielded as soon as it
+        is ready, so memory use does not grow with the number of texts.
+        Params:
+            texts: a string or list of strings to be classified. Each string is classified separately.
+            chunk_size: the number of texts processed at a time
+            as_arrays: if True, each chunk is yielded as a ClassificationResult (see results.py)
+
+        Yields:
+            The result of get_esg_sentiment for each chunk of texts, in the order of the texts
+        """
+        for chunk in iter_chunks(texts, chunk_size):
+            yield self.get_esg_sentiment(chunk, as_arrays)
@@ -0,0 +1,279 @@
+"""
+Local inference service for the corenlp sequence classification models.
+Each pipeline script normally loads its own copy of the FinBERT models and runs its own small batches. The service
+holds one copy of each model and is reached over localhost HTTP by any number of pipeline jobs on the host. Requests
+for the same model that arrive within a short latency window are coalesced into one batch before being run.
+
+The service is started from the processing folder with
+    python -m corenlp.inference_service --port 8765
+
+and the classes are switched to client mode by passing the service url, e.g.
+    EsgTextClassification(service_url="http://127.0.0.1:8765")
+"""
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import List
+
+import torch
+
+from .backends import BACKENDS
+from .batching import run_batched_inference
+from .registry import acquire_sequence_classifier
+
+DEFAULT_SERVICE_MODELS = ["yiyanghkust/finbert-esg", "yiyanghkust/finbert-esg-9-categories", "TrajanovRisto/bert-esg"]
+DEFAULT_MAX_BATCH_TEXTS = 256
+DEFAULT_MAX_WAIT_MS = 10.0
+
+logger = logging.getLogger("corenlp_inference_service")
+
+
+class MicroBatcher:
+    """
+    Coalesces the requests for a model into batches.
+    A batch is run once it has max_batch_texts texts or max_wait_ms has passed since its first request arrived.
+    """
+
+    def __init__(self, tokenizer, model, max_batch_texts: int = DEFAULT_MAX_BATCH_TEXTS,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_batch_texts = max_batch_texts
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queues the texts to be run and returns a future for their (texts x labels) probabilities"""
+        future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _next_batch(self):
+        pending = [self._queue.get()]
+        num_texts = len(pending[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while num_texts < self.max_batch_texts:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            num_texts += len(pending[-1][0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._next_batch()
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            try:
+                probs = run_batched_inference(texts, self.tokenizer, self.model, max_length=512)
+            except Exception:
+                # Run each request on its own so that only the requests that fail get the error
+                self._run_separately(pending)
+                continue
+            self.requests += len(pending)
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for request_texts, future in pending:
+                future.set_result(probs[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def _run_separately(self, pending):
+        for request_texts, future in pending:
+            try:
+                probs = run_batched_inference(request_texts, self.tokenizer, self.model, max_length=512)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.requests += 1
+            self.batches += 1
+            self.texts += len(request_texts)
+            future.set_result(probs)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "batches": self.batches, "texts": self.texts,
+                "texts_per_batch": self.texts / self.batches if self.batches > 0 else 0.0}
+
+
+class InferenceService:
+    """
+    Holds the models served by the inference service and a MicroBatcher for each.
+    Params:
+        model_names: the HuggingFace sequence classification models to serve
+        backend: the backend used to run the models (see backends.py)
+        max_batch_texts, max_wait_ms: the batch size and latency window of the MicroBatcher of each model
+    """
+
+    def __init__(self, model_names: List[str] = None, backend: str = "torch",
+                 max_batch_texts: int = DEFAULT_MAX_BATCH_TEXTS, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self.backend = backend
+        self.batchers = {}
+        self.configs = {}
+        for model_name in model_names or DEFAULT_SERVICE_MODELS:
+            tokenizer, model = acquire_sequence_classifier(model_name, backend)
+            self.batchers[model_name] = MicroBatcher(tokenizer, model, max_batch_texts, max_wait_ms)
+            self.configs[model_name] = {"name_or_path": model_name,
+                                        "id2label": {str(idx): label for idx, label in model.config.id2label.items()},
+                                        "num_labels": model.config.num_labels,
+                                        "commit_hash": getattr(model.config, "_commit_hash", None),
+                                        "backend": backend}
+
+    def model_info(self, model_name: str) -> dict:
+        if model_name not in self.configs:
+            raise KeyError(f"Model '{model_name}' is not served. Served models are {list(self.configs.keys())}")
+        return self.configs[model_name]
+
+    def predict(self, model_name: str, texts: List[str]) -> torch.Tensor:
+        if model_name not in self.batchers:
+            raise KeyError(f"Model '{model_name}' is not served. Served models are {list(self.batchers.keys())}")
+        return self.batchers[model_name].submit(texts).result()
+
+    def stats(self) -> dict:
+        return {model_name: batcher.stats() for model_name, batcher in self.batchers.items()}
+
+
+def _make_handler(service: InferenceService):
+    class InferenceRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"models": list(service.configs.keys()), "stats": service.stats()})
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if self.path == "/info":
+                    self._send_json(200, service.model_info(request["model"]))
+                elif self.path == "/predict":
+                    texts = request.get("texts")
+                    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                        self._send_json(400, {"error": "texts must be a list of strings"})
+                        return
+                    probs = service.predict(request["model"], texts)
+                    self._send_json(200, {"probs": probs.tolist()})
+                else:
+                    self._send_json(404, {"error": f"Unknown path {self.path}"})
+            except KeyError as e:
+                self._send_json(404, {"error": e.args[0]})
+            except Exception as e:
+                logger.exception("Failed to process request")
+                self._send_json(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return InferenceRequestHandler
+
+
+def serve(service: InferenceService, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """Creates the HTTP server for the service. Call serve_forever() on the returned server to start serving"""
+    server = ThreadingHTTPServer((host, port), _make_handler(service))
+    server.daemon_threads = True
+    return server
+
+
+class InferenceClient:
+    """
+    Client for the inference service.
+    Params:
+        service_url: the url of the service, e.g. http://127.0.0.1:8765
+        timeout: the timeout in seconds of each request
+    """
+
+    def __init__(self, service_url: str, timeout: float = 600):
+        self.service_url = service_url.rstrip("/")
+        self.timeout = timeout
+
+    def _post(self, path: str, body: dict) -> dict:
+        request = urllib.request.Request(f"{self.service_url}{path}", data=json.dumps(body).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"The inference service at {self.service_url} returned an error: "
+                               f"{json.loads(e.read()).get('error')}") from e
+
+    def model_info(self, model_name: str) -> dict:
+        return self._post("/info", {"model": model_name})
+
+    def predict(self, model_name: str, texts: List[str]) -> torch.Tensor:
+        """Returns the (texts x labels) probabilities predicted by the model for the texts"""
+        return torch.tensor(self._post("/predict", {"model": model_name, "texts": texts})["probs"])
+
+
+class RemoteSequenceClassifier:
+    """
+    Stands in for a HuggingFace sequence classification model that is served by the inference service.
+    It has the config of the model (labels, name and revision) and predicts the probabilities of texts.
+    """
+
+    def __init__(self, client: InferenceClient, model_name: str):
+        self.client = client
+        self.model_name = model_name
+        info = client.model_info(model_name)
+        self.backend = info["backend"]
+        self.config = SimpleNamespace(name_or_path=info["name_or_path"], num_labels=info["num_labels"],
+                                      id2label={int(idx): label for idx, label in info["id2label"].items()},
+                                      _commit_hash=info["commit_hash"])
+
+    def predict(self, texts) -> torch.Tensor:
+        if isinstance(texts, str):
+            texts = [texts]
+        if len(texts) == 0:
+            return torch.zeros((0, self.config.num_labels))
+        return self.client.predict(self.model_name, texts)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(encoding='utf-8', level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help="The address the service listens on. Default 127.0.0.1 (local connections only)")
+    parser.add_argument("--port", type=int, default=8765, help="The port the service listens on. Default 8765")
+    parser.add_argument("--models", nargs="+", default=DEFAULT_SERVICE_MODELS,
+                        help="The HuggingFace models to serve. Default is the corenlp classification models")
+    parser.add_argument("--backend", type=str, default="torch", choices=BACKENDS,
+                        help="The backend used to run the models. Default torch")
+    parser.add_argument("--max_batch_texts", type=int, default=DEFAULT_MAX_BATCH_TEXTS,
+                        help=f"The maximum number of texts coalesced into one batch. Default {DEFAULT_MAX_BATCH_TEXTS}")
+    parser.add_argument("--max_wait_ms", type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help="How long (milliseconds) to wait for more requests before running a batch. "
+                             f"Default {DEFAULT_MAX_WAIT_MS}")
+    args = parser.parse_args()
+
+    inference_service = InferenceService(args.models, args.backend, args.max_batch_texts, args.max_wait_ms)
+    http_server = serve(inference_service, args.host, args.port)
+    logger.info(f"Serving {args.models} on http://{args.host}:{args.port}")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
@@ -0,0 +1,156 @@
+"""
+Store of the sentence embeddings of keywords used by EsgKeywordExtractor to cluster the keywords of a document.
+The keyword vocabulary repeats across documents so each keyword is encoded once and its embedding kept in a float32
+file that is memory mapped, one row per keyword. The keywords (in row order) are kept in a text file next to it, with
+a header recording the model and dimension of the embeddings.
+    <path>            - the (keywords x dim) float32 embeddings
+    <path>.keywords   - the header line then one keyword per line
+    <path>.lock       - locked while the store is loaded or appended to, so several processes can share the store
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .keyword_labels import normalize_keyword
+
+
+class KeywordEmbeddingStore:
+    """
+    Embeddings of normalised keywords, memory mapped from a file if path is given.
+    Params:
+        path: path to the file used to persist the embeddings. If None, the embeddings are only kept in memory
+        model_name: the name of the model used to encode the keywords, a store of another model cannot be opened
+        dim: the dimension of the embeddings
+    """
+
+    def __init__(self, path: Optional[str], model_name: str, dim: int):
+        self.path = path
+        self.model_name = model_name
+        self.dim = dim
+        self.index: Dict[str, int] = {}
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        # Position in the keywords file up to which the keywords have been read into the index
+        self._keywords_offset = 0
+        if path is not None:
+            self._load()
+
+    @property
+    def _keywords_path(self) -> str:
+        return self.path + ".keywords"
+
+    @property
+    def _row_bytes(self) -> int:
+        return self.dim * np.dtype(np.float32).itemsize
+
+    def _header(self) -> dict:
+        return {"model": self.model_name, "dim": self.dim}
+
+    @contextmanager
+    def _locked(self):
+        """Holds an exclusive lock on the store, so another process never reads or truncates a half written row"""
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _load(self):
+        with self._locked():
+            keywords = []
+            if os.path.exists(self._keywords_path):
+                with open(self._keywords_path, encoding="utf-8") as f:
+                    header = json.loads(f.readline())
+                    if header != self._header():
+                        raise ValueError(f"The keyword embedding store {self.path} holds embeddings of {header}, "
+                                         f"not {self._header()}")
+                    keywords = [line.rstrip("\n") for line in f]
+            file_size = os.path.getsize(self.path) if os.path.exists(self.path) else None
+            num_rows = (file_size or 0) // self._row_bytes
+
+            # An interrupted write can leave a keyword without an embedding or the reverse, drop the incomplete
+            # entries. No other process is writing while the lock is held
+            num_keywords = min(len(keywords), num_rows)
+            if num_keywords < len(keywords) or not os.path.exists(self._keywords_path):
+                with open(self._keywords_path, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(self._header()) + "\n")
+                    f.writelines(keyword + "\n" for keyword in keywords[:num_keywords])
+            if file_size != num_keywords * self._row_bytes:
+                with open(self.path, "ab") as f:
+                    f.truncate(num_keywords * self._row_bytes)
+
+            self.index = {keyword: row for row, keyword in enumerate(keywords[:num_keywords])}
+            self._keywords_offset = os.path.getsize(self._keywords_path)
+            self._map()
+
+    def _read_new_keywords(self):
+        """Adds the keywords appended to the store by other processes since it was last read. Needs the lock"""
+        with open(self._keywords_path, "rb") as f:
+            f.seek(self._keywords_offset)
+            new_lines = f.read()
+        self._keywords_offset += len(new_lines)
+        for keyword in new_lines.decode("utf-8").splitlines():
+            self.index.setdefault(keyword, len(self.index))
+
+    def _map(self):
+        if len(self.index) > 0:
+            self._vectors = np.memmap(self.path, dtype=np.float32, mode="r", shape=(len(self.index), self.dim))
+
+    def __contains__(self, keyword: str) -> bool:
+        return normalize_keyword(keyword) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, keyword: str) -> np.ndarray:
+        """Returns the embedding of the keyword, a read only view of the store"""
+        return self._vectors[self.index[normalize_keyword(keyword)]]
+
+    def get_many(self, keywords: List[str]) -> np.ndarray:
+        """
+        Returns the (keywords x dim) embeddings of the keywords. When the keywords are in consecutive rows of the store
+        (e.g. keywords that were added together) this is a read only view of the store, otherwise a copy
+        """
+        rows = [self.index[normalize_keyword(keyword)] for keyword in keywords]
+        if len(rows) > 0 and rows == list(range(rows[0], rows[0] + len(rows))):
+            return self._vectors[rows[0]:rows[0] + len(rows)]
+        return self._vectors[rows]
+
+    def add_many(self, keywords: Iterable[str], embeddings: np.ndarray):
+        """Stores the embeddings of the keywords. Keywords that are already stored keep their embedding"""
+        if self.path is None:
+            self._add_rows(keywords, embeddings)
+            return
+        with self._locked():
+            # Rows appended by other processes come first, so the keywords they added are not stored twice
+            self._read_new_keywords()
+            new_keywords, new_vectors = self._add_rows(keywords, embeddings)
+            if len(new_keywords) > 0:
+                # The embeddings are written before the keywords so a keyword is never stored without its embedding
+                with open(self.path, "ab") as f:
+                    f.write(new_vectors.tobytes())
+                with open(self._keywords_path, "ab") as f:
+                    new_lines = "".join(keyword + "\n" for keyword in new_keywords).encode("utf-8")
+                    f.write(new_lines)
+                self._keywords_offset += len(new_lines)
+            self._map()
+
+    def _add_rows(self, keywords: Iterable[str], embeddings: np.ndarray):
+        """Adds the keywords not in the index, returning them and their embeddings"""
+        new_keywords = []
+        new_rows = []
+        for keyword, embedding in zip(keywords, embeddings):
+            keyword = normalize_keyword(keyword)
+            if keyword in self.index:
+                continue
+            self.index[keyword] = len(self.index)
+            new_keywords.append(keyword)
+            new_rows.append(embedding)
+        new_vectors = np.asarray(new_rows, dtype=np.float32).reshape(len(new_rows), self.dim)
+        if self.path is None and len(new_rows) > 0:
+            self._vectors = np.concatenate([self._vectors, new_vectors])
+        return new_keywords, new_vectors
@@ -0,0 +1,70 @@
+"""
+Store of the FinBERT-ESG classification of keywords used by EsgKeywordExtractor to filter non-ESG keywords.
+The keywords extracted from news articles come from a limited vocabulary that repeats across articles, so the label and
+score of each keyword are kept in a dictionary (optionally persisted to a SQLite file) and a keyword is only run
+through the model the first time it is seen.
+"""
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+
+def normalize_keyword(keyword: str) -> str:
+    """Normalises the whitespace in a keyword, which does not change how the keyword is classified"""
+    return " ".join(keyword.split())
+
+
+class KeywordLabelStore:
+    """
+    Dictionary of keyword -> (label, score), loaded from and saved to a SQLite file if db_path is given.
+    Params:
+        db_path: path to the SQLite database file used to persist the labels. If None, the labels are only kept in memory
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path
+        self.labels: Dict[str, Tuple[str, float]] = {}
+        self.conn = None
+        if db_path is not None:
+            self.conn = sqlite3.connect(db_path, timeout=60)
+            cur = self.conn.cursor()
+            cur.execute("""CREATE TABLE IF NOT EXISTS keyword_labels (
+                                keyword text PRIMARY KEY,
+                                label text NOT NULL,
+                                score real NOT NULL,
+                                timestamp text NOT NULL
+                            )""")
+            self.conn.commit()
+            # The keyword vocabulary is small enough to be held in memory
+            cur.execute("SELECT keyword, label, score FROM keyword_labels")
+            self.labels = {keyword: (label, score) for keyword, label, score in cur.fetchall()}
+            cur.close()
+
+    def __contains__(self, keyword: str) -> bool:
+        return normalize_keyword(keyword) in self.labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get(self, keyword: str) -> Optional[Tuple[str, float]]:
+        """Returns the (label, score) of the keyword, or None if the keyword has not been classified"""
+        return self.labels.get(normalize_keyword(keyword))
+
+    def put_many(self, keyword_labels: Iterable[Tuple[str, str, float]]):
+        """Stores the (keyword, label, score) of a set of classified keywords"""
+        rows = [(normalize_keyword(keyword), label, float(score)) for keyword, label, score in keyword_labels]
+        for keyword, label, score in rows:
+            self.labels[keyword] = (label, score)
+        if self.conn is None or len(rows) == 0:
+            return
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        cur = self.conn.cursor()
+        cur.executemany("INSERT OR REPLACE INTO keyword_labels(keyword, label, score, timestamp) VALUES(?, ?, ?, ?)",
+                        [row + (timestamp,) for row in rows])
+        self.conn.commit()
+        cur.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
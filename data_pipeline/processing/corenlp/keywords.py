@@ -1,66 +1,161 @@
-from typing import List
+import itertools
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Tuple
 import textacy
 from textacy import extract
-import re
-from transformers import pipeline
 from sklearn.cluster import KMeans
 from sklearn.metrics import pairwise_distances_argmin_min
 import numpy as np
 from sentence_transformers import SentenceTransformer
 
+from .batching import run_batched_inference
+from .keyword_embeddings import KeywordEmbeddingStore
+from .keyword_labels import KeywordLabelStore, normalize_keyword
+from .registry import acquire_sequence_classifier, model_registry
+from .term_matching import TermTrie
+
+# Keywords are kept if FinBERT-ESG classifies them as an ESG category with at least this probability
+ESG_KEYWORD_MIN_SCORE = 0.6
+# The en_core_web_sm components needed by textrank (POS tags and lemmas), the others are disabled when streaming
+TEXTRANK_PIPES = ("tok2vec", "tagger", "attribute_ruler", "lemmatizer")
+DEFAULT_PIPE_BATCH_SIZE = 64
+# The sentence embedding model used to cluster the keywords of a document
+KEYWORD_EMBEDDING_MODEL = 'paraphrase-MiniLM-L12-v2'
+
 
 class EsgKeywordExtractor:
     """
     Class to extract ESG related keywords from text
+    Params:
+        keyword_cache: path to the SQLite file used to keep the FinBERT-ESG classification of each keyword seen, so that
+            a keyword is only classified once. If None, the classifications are only kept in memory
+        keyword_embeddings: path to the file used to keep the embedding of each keyword seen, so that a keyword is
+            only encoded once (see KeywordEmbeddingStore). If None, the embeddings are only kept in memory
     """
 
-    def __init__(self):
+    def __init__(self, keyword_cache: str = None, keyword_embeddings: str = None):
         model_name = "yiyanghkust/finbert-esg"
-        self.spacy_en = textacy.load_spacy_lang("en_core_web_sm", disable=("parser,"))
+        # Only needed to parse raw texts (DocumentAnalysis passes docs it has parsed), so it is loaded on first use
+        self._spacy_en = None
         # Used to filter non-ESG related keywords
-        self.esg_text_classifier = pipeline("text-classification", model=model_name)
-        self.cluster_embeddings_model = SentenceTransformer('paraphrase-MiniLM-L12-v2')
+        # The model is shared through the registry with the EsgTextClassification course grained classifier
+        self.esg_text_classifier_tokenizer, self.esg_text_classifier_model = acquire_sequence_classifier(model_name)
+        self.cluster_embeddings_model = model_registry.acquire(
+            ("sentence-transformer", KEYWORD_EMBEDDING_MODEL),
+            lambda: SentenceTransformer(KEYWORD_EMBEDDING_MODEL))
+        self.keyword_labels = KeywordLabelStore(keyword_cache)
+        self.keyword_embeddings = KeywordEmbeddingStore(
+            keyword_embeddings, KEYWORD_EMBEDDING_MODEL,
+            self.cluster_embeddings_model.get_sentence_embedding_dimension())
+
+    @property
+    def spacy_en(self):
+        """The en_core_web_sm pipeline used to parse the texts for textrank, loaded the first time it is used"""
+        if self._spacy_en is None:
+            self._spacy_en = textacy.load_spacy_lang("en_core_web_sm", disable=("parser,"))
+        return self._spacy_en
 
     @staticmethod
     def _remove_ignores(doc: str, ignore_list: List[str]) -> str:
         """
-        Removes a set of words or phrases from a document that we want to ignore
+        Removes a set of words or phrases from a document that we want to ignore.
+        The terms are matched as whole words, ignoring case, in a single pass over the document (see TermTrie)
         """
-        starts_re = "(^|\s|\W)"
-        ends_re = "($|\s|\W)"
-
-        # [^\w\s]+
         if ignore_list is None:
             return doc
-        regex_replacements = [(f"{starts_re}{re.escape(item)}{ends_re}", " ") for item in ignore_list]
-        for old, new in regex_replacements:
-            doc = re.sub(old, new, doc, flags=re.IGNORECASE)
+        return TermTrie(ignore_list).replace(doc, " ")
 
-        return doc
+    def classify_keywords(self, keywords: List[str]) -> Dict[str, Tuple[str, float]]:
+        """
+        Returns the FinBERT-ESG (label, score) of each keyword.
+        Keywords that have been classified before are served from the keyword store, the rest are classified
+        together in one batched call and added to the store
+        """
+        new_keywords = list(dict.fromkeys(normalize_keyword(kw) for kw in keywords if kw not in self.keyword_labels))
+        if len(new_keywords) > 0:
+            probs = run_batched_inference(new_keywords, self.esg_text_classifier_tokenizer,
+                                          self.esg_text_classifier_model)
+            scores, label_idx = probs.max(dim=-1)
+            id2label = self.esg_text_classifier_model.config.id2label
+            self.keyword_labels.put_many((kw, id2label[idx], score) for kw, idx, score in
+                                         zip(new_keywords, label_idx.tolist(), scores.tolist()))
+        return {kw: self.keyword_labels.get(kw) for kw in keywords}
+
+    @staticmethod
+    def _is_esg_keyword(label_and_score: Tuple[str, float]) -> bool:
+        label, score = label_and_score
+        return label != "None" and score >= ESG_KEYWORD_MIN_SCORE
 
     def remove_non_esg_keywords(self, keywords):
         """Uses FinBert to filter any non-ESG related keywords"""
-        kw_list = []
-        for kw in keywords:
-            res = self.esg_text_classifier(kw)[0]
-            if res['label'] != "None" and res['score'] >= 0.6:
-                kw_list.append(kw)
-        return kw_list
+        keyword_labels = self.classify_keywords(keywords)
+        return [kw for kw in keywords if self._is_esg_keyword(keyword_labels[kw])]
+
+    def remove_non_esg_keywords_many(self, keyword_lists: List[List[str]]) -> List[List[str]]:
+        """
+        Filters the non-ESG keywords of many documents, classifying the new keywords of all the documents in one call
+        """
+        keyword_labels = self.classify_keywords([kw for keywords in keyword_lists for kw in keywords])
+        return [[kw for kw in keywords if self._is_esg_keyword(keyword_labels[kw])] for keywords in keyword_lists]
+
+    def warm_keyword_cache(self, conn: sqlite3.Connection) -> int:
+        """
+        Classifies the keywords stored in the document_keywords table of the insights database that are not in the
+        keyword store yet, so that they are served from the store. Returns the number of keywords that were classified
+        """
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT keyword FROM document_keywords")
+        keywords = [row[0] for row in cur.fetchall() if row[0] is not None and row[0] not in self.keyword_labels]
+        cur.close()
+        num_known = len(self.keyword_labels)
+        self.classify_keywords(keywords)
+        return len(self.keyword_labels) - num_known
 
     def _get_keywords_textrank(self, text, ignore_list=None, top_n=10):
         """Uses Textacy to generate the keywords using Text Rank"""
-        doc = textacy.make_spacy_doc(self._remove_ignores(text, ignore_list), lang="en_core_web_sm")
+        doc = textacy.make_spacy_doc(self._remove_ignores(text, ignore_list), lang=self.spacy_en)
+        return self.textrank_terms(doc, top_n)
+
+    def _get_keywords_textrank_many(self, texts: Iterable[str], ignore_lists: Iterable[List[str]] = None,
+                                    top_n: int = 10, batch_size: int = DEFAULT_PIPE_BATCH_SIZE,
+                                    n_process: int = 1) -> Iterator[List[str]]:
+        """
+        Generates the Text Rank keywords of each text, streaming the texts through spaCy's nlp.pipe with only the
+        components needed by textrank enabled
+        """
+        if ignore_lists is None:
+            ignore_lists = itertools.repeat(None)
+        cleaned_texts = (self._remove_ignores(text, ignore_list) for text, ignore_list in zip(texts, ignore_lists))
+        disable = [name for name in self.spacy_en.pipe_names if name not in TEXTRANK_PIPES]
+        for doc in self.spacy_en.pipe(cleaned_texts, batch_size=batch_size, n_process=n_process, disable=disable):
+            yield self.textrank_terms(doc, top_n)
+
+    @staticmethod
+    def textrank_terms(doc, top_n: int = 10) -> List[str]:
+        """Returns the Text Rank keywords of a spaCy doc with POS tags and lemmas"""
         top_terms = [kps for kps, weights in extract.keyterms.textrank(doc, normalize="lemma", topn=top_n)]
         textrank_terms = textacy.extract.utils.aggregate_term_variants(set(top_terms))
         # Construct list using one term from each aggregated set of terms
         textrank_terms = [term_set.pop() for term_set in textrank_terms]
         return textrank_terms
 
+    def embed_keywords(self, keywords: List[str]) -> np.ndarray:
+        """
+        Returns the (keywords x dim) embeddings of the keywords.
+        Keywords that have been encoded before are served from the embedding store, the rest are encoded together in
+        one call and added to the store
+        """
+        new_keywords = list(dict.fromkeys(normalize_keyword(kw) for kw in keywords
+                                          if kw not in self.keyword_embeddings))
+        if len(new_keywords) > 0:
+            self.keyword_embeddings.add_many(
+                new_keywords, self.cluster_embeddings_model.encode(new_keywords, convert_to_numpy=True))
+        return self.keyword_embeddings.get_many(keywords)
+
     def _get_clustered_labels(self, keywords: List[str], n_clusters: int = 3):
         num_clusters = min(len(keywords), n_clusters)
-        # Compute embeddings
-        embeddings = np.array(self.cluster_embeddings_model.encode(keywords, convert_to_tensor=True),
-                              dtype=np.float32)
+        # Get the embeddings from the store, only encoding the keywords not seen before
+        embeddings = self.embed_keywords(keywords)
         # Cluster embeddings in vector space
         cluster_model = KMeans(n_clusters=n_clusters, n_init='auto')
         clustering = cluster_model.fit(embeddings)
@@ -81,3 +176,37 @@ class EsgKeywordExtractor:
             keywords = self._get_clustered_labels(keywords)
 
         return keywords
+
+    def get_esg_keywords_many(self, texts: Iterable[str], ignore_terms: Iterable[List[str]] = None,
+                              filter_non_esg_keywords: bool = True, top_n: int = 10,
+                              batch_size: int = DEFAULT_PIPE_BATCH_SIZE, n_process: int = 1) -> Iterator[List[str]]:
+        """
+        Generates the ESG keywords of each of a stream of texts, in the same order as the texts.
+        Params:
+            texts: the texts, which can be a generator
+            ignore_terms: the list of terms to ignore for each text, or None
+            filter_non_esg_keywords: whether to remove the keywords that FinBERT-ESG does not classify as ESG
+            top_n: the number of Text Rank keywords extracted from each text before filtering and clustering
+            batch_size: the number of texts parsed by spaCy in each batch
+            n_process: the number of processes used by spaCy to parse the texts
+        """
+        keyword_stream = self._get_keywords_textrank_many(texts, ignore_terms, top_n=top_n, batch_size=batch_size,
+                                                          n_process=n_process)
+        while True:
+            keyword_lists = list(itertools.islice(keyword_stream, batch_size))
+            if len(keyword_lists) == 0:
+                break
+            yield from self.filter_and_cluster_keywords_many(keyword_lists, filter_non_esg_keywords)
+
+    def filter_and_cluster_keywords_many(self, keyword_lists: List[List[str]],
+                                         filter_non_esg_keywords: bool = True) -> List[List[str]]:
+        """
+        Filters the non-ESG keywords (if required) and clusters the keywords of each of a batch of documents.
+        The new keywords of the batch are classified in one call and encoded in one call
+        """
+        if filter_non_esg_keywords:
+            keyword_lists = self.remove_non_esg_keywords_many(keyword_lists)
+        self.embed_keywords([kw for keywords in keyword_lists if len(keywords) >= 3 for kw in keywords])
+        # Cluster keywords to remove duplication
+        return [self._get_clustered_labels(keywords) if len(keywords) >= 3 else keywords
+                for keywords in keyword_lists]
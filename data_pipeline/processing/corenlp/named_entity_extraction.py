@@ -1,9 +1,40 @@
-import spacy
+from typing import Iterable, Iterator
+
+from .registry import acquire_spacy_model
+
+DEFAULT_NER_MODEL = 'en_core_web_trf'
+# Smaller CNN pipelines that trade some accuracy for much higher throughput
+FAST_NER_MODELS = ('en_core_web_sm', 'en_core_web_md')
+# The components that set doc.ents, the others are disabled apart from the embedding layers these listen to
+ENTITY_PIPES = ('ner', 'entity_ruler')
+DEFAULT_NER_BATCH_SIZE = 32
+
+
+def disabled_pipes(nlp, needed_pipes=ENTITY_PIPES) -> list:
+  """
+  Returns the names of the pipeline components that are not needed, by default those not needed to set doc.ents.
+  The tok2vec/transformer layers are kept if one of the needed components listens to them
+  """
+  keep = {name for name in nlp.pipe_names if name in needed_pipes}
+  for name in nlp.pipe_names:
+    listeners = getattr(nlp.get_pipe(name), 'listening_components', [])
+    if any(listener in keep for listener in listeners):
+      keep.add(name)
+  return [name for name in nlp.pipe_names if name not in keep]
+
 
 class EntityExtractor:
-  def __init__(self):
-    # load NER transformer model from spacy
-    self.nlp = spacy.load('en_core_web_trf')
+  """
+  Params:
+    model: the spaCy pipeline used to extract the entities. Default en_core_web_trf, en_core_web_sm or en_core_web_md
+      can be used for higher throughput
+  """
+  def __init__(self, model: str = DEFAULT_NER_MODEL):
+    # load NER model from spacy, shared through the registry with other users of the model
+    self.model = model
+    self.nlp = acquire_spacy_model(model)
+    # Only the components needed for doc.ents are run
+    self.disabled_pipes = disabled_pipes(self.nlp)
     
   def extract_entities(self, text: str) -> dict[str, list]:
     """
@@ -24,9 +55,23 @@ class EntityExtractor:
 
     """
 
+    doc = self.nlp(text, disable=self.disabled_pipes)
+    return self.entities_from_doc(doc)
+
+  def extract_entities_many(self, texts: Iterable[str], batch_size: int = DEFAULT_NER_BATCH_SIZE,
+                            n_process: int = 1) -> Iterator[dict[str, list]]:
+    """
+    Extracts the entities of a stream of texts, yielding the dictionary of entities of each text in the same order
+    as the texts (see extract_entities).
+    The texts are run through spaCy's nlp.pipe in batches of batch_size, using n_process processes
+    """
+    for doc in self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=self.disabled_pipes):
+      yield self.entities_from_doc(doc)
+
+  def entities_from_doc(self, doc) -> dict[str, list]:
+    """Returns the dictionary of entities (see extract_entities) of a spaCy doc that has been run through the NER"""
     # initialize a dictionary with required entities   
     entities = {"ORG":[], "PERSON":[], "GPE":[]}
-    doc = self.nlp(text)
     # loop through the identified entities and append detected entities to the dictionary
     for entity in doc.ents:
         if entity.label_ == 'ORG' and entity.text.lower():
@@ -1,14 +1,15 @@
-import spacy
 from spacy.kb import InMemoryLookupKB, KnowledgeBase
 import csv
 from pathlib import Path
 
+from .registry import acquire_spacy_model
+
 class CustomNEL:
 
     
     def __init__(self, nlp_path, ner_custom_path = None):
         #nlp_path contains the English trained pipeline with a custom entity linking component
-        self.nlp = spacy.load(nlp_path)
+        self.nlp = acquire_spacy_model(nlp_path)
         #kb_path is custom knowledge base
         # self.kb_path = kb_path
         #initializing knowledge base
@@ -1,22 +1,82 @@
-# This is a sample code for Named Entity Recognition (NER) using spaCy.
+# Custom Named Entity Recognition (NER) using spaCy.
+# The NER model is trained once with the training command, which saves each trained model as a new version:
+#   python -m corenlp.ner --train_data ner_train.jsonl --output_dir ner_model
+# and the saved model is loaded once by CustomNerTagger to tag texts.
 
-import spacy
+import argparse
+import hashlib
+import json
+import logging
+import os
 import random
+import uuid
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import spacy
 from spacy.training.example import Example
 
+from .named_entity_extraction import disabled_pipes
+from .registry import acquire_spacy_model, release_spacy_model
+
+DEFAULT_NER_MODEL_DIR = "ner_model"
+# File in the model folder holding the version of the latest trained model
+LATEST_VERSION_FILE = "LATEST"
+# File in each model version folder describing how the model was trained
+TRAINING_INFO_FILE = "training_info.json"
+
+# Example data
+EXAMPLE_TRAIN_DATA = [
+    ("Apple is a technology company.", {"entities": [(0, 5, "ORG")]}),
+    ("Microsoft develops Windows.", {"entities": [(0, 9, "ORG")]}),
+]
+
+logger = logging.getLogger("corenlp_ner")
 
-def ner_analysis():
-    # Example data
-    train_data = [
-        ("Apple is a technology company.", {"entities": [(0, 5, "ORG")]}),
-        ("Microsoft develops Windows.", {"entities": [(0, 9, "ORG")]}),
-    ]
 
-    # Load spaCy English model
-    nlp = spacy.load("en_core_web_sm")
+def load_training_data(path: str) -> List[Tuple[str, dict]]:
+    """
+    Loads NER training data from a JSON lines file with one example per line, of the form
+        {"text": "Apple is a technology company.", "entities": [[0, 5, "ORG"]]}
+    """
+    train_data = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            example = json.loads(line)
+            train_data.append((example["text"], {"entities": [tuple(ent) for ent in example["entities"]]}))
+    return train_data
 
-    # Train the NER model on the initial data
-    if "ner" not in nlp.pipe_names:
+
+def _training_data_hash(train_data: List[Tuple[str, dict]]) -> str:
+    return hashlib.sha256(json.dumps(train_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def train_ner_model(train_data: List[Tuple[str, dict]], output_dir: str = DEFAULT_NER_MODEL_DIR,
+                    base_model: str = "en_core_web_sm", epochs: int = 10, dropout: float = 0.5,
+                    seed: int = 0) -> str:
+    """
+    Trains the NER component of a spaCy pipeline and saves it as a new version in the output folder.
+    Each version is saved to <output_dir>/<version> with a training_info.json file describing how it was trained,
+    and <output_dir>/LATEST is updated to the new version. The version is the time of training, the hash of the
+    training data and a random suffix, so runs started at the same time never share a folder.
+    Returns the path to the saved model
+    Params:
+        train_data: the (text, {"entities": [(start, end, label), ...]}) training examples
+        output_dir: the folder the model versions are saved to
+        base_model: the spaCy pipeline whose NER component is trained
+        epochs: the number of passes over the training data
+        dropout: the dropout rate used when updating the model
+        seed: the seed used to shuffle the training data
+    """
+    train_data = list(train_data)
+    data_hash = _training_data_hash(train_data)
+    nlp = spacy.load(base_model)
+
+    # Train the NER model on the training data
+    base_has_ner = "ner" in nlp.pipe_names
+    if not base_has_ner:
         ner = nlp.add_pipe("ner")
     else:
         ner = nlp.get_pipe("ner")
@@ -26,35 +86,112 @@ def ner_analysis():
         for ent in annotations.get("entities"):
             ner.add_label(ent[2])
 
+    examples = [Example.from_dict(nlp.make_doc(text), annotations) for text, annotations in train_data]
     # Disable other pipes during training
     other_pipes = [pipe for pipe in nlp.pipe_names if pipe != "ner"]
-    with nlp.disable_pipes(*other_pipes):
-        # Training loop
-        for epoch in range(10):  # Adjust the number of epochs as needed
-            random.shuffle(train_data)
+    rng = random.Random(seed)
+    with nlp.select_pipes(disable=other_pipes):
+        # A trained NER component is fine-tuned, a new one is initialised from the examples
+        optimizer = nlp.resume_training() if base_has_ner else nlp.initialize(lambda: examples)
+        for epoch in range(epochs):
+            rng.shuffle(examples)
             losses = {}
-            examples = []
-            for text, annotations in train_data:
-                example = Example.from_dict(nlp.make_doc(text), annotations)
-                examples.append(example)
-
             # Update the model with examples
-            nlp.update(examples, drop=0.5, losses=losses)
+            nlp.update(examples, drop=dropout, sgd=optimizer, losses=losses)
+            logger.info(f"Epoch {epoch + 1} of {epochs} - losses {losses}")
+
+    # Save the trained model as a new version
+    version = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{data_hash[:8]}-{uuid.uuid4().hex[:8]}"
+    model_path = os.path.join(output_dir, version)
+    # Fails rather than mixing the files of two runs if the version folder already exists
+    os.makedirs(model_path, exist_ok=False)
+    nlp.to_disk(model_path)
+    training_info = {"version": version, "base_model": base_model, "epochs": epochs, "dropout": dropout,
+                     "seed": seed, "num_examples": len(train_data), "training_data_sha256": data_hash,
+                     "labels": sorted(ner.labels), "timestamp": datetime.now().isoformat()}
+    with open(os.path.join(model_path, TRAINING_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(training_info, f, indent=2)
+    # LATEST is replaced in one step so that it is never read half written
+    latest_tmp_path = os.path.join(output_dir, f"{LATEST_VERSION_FILE}.{version}.tmp")
+    with open(latest_tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(latest_tmp_path, os.path.join(output_dir, LATEST_VERSION_FILE))
+    logger.info(f"Saved NER model version {version} to {model_path}")
+    return model_path
+
+
+def latest_ner_model_version(model_dir: str = DEFAULT_NER_MODEL_DIR) -> Optional[str]:
+    """Returns the latest version of the NER model saved in the folder, or None if no model has been trained"""
+    latest_path = os.path.join(model_dir, LATEST_VERSION_FILE)
+    if not os.path.exists(latest_path):
+        return None
+    with open(latest_path, encoding="utf-8") as f:
+        return f.read().strip()
+
+
+class CustomNerTagger:
+    """
+    Tags texts with a trained custom NER model. The model is loaded once, when the tagger is created.
+    Params:
+        model_dir: the folder the NER model versions are saved to by train_ner_model
+        version: the version of the model to load, the latest version if None
+    """
+
+    def __init__(self, model_dir: str = DEFAULT_NER_MODEL_DIR, version: str = None):
+        if version is None:
+            version = latest_ner_model_version(model_dir)
+            if version is None:
+                raise FileNotFoundError(f"No trained NER model found in {model_dir}. Train one with "
+                                        f"python -m corenlp.ner --output_dir {model_dir}")
+        self.version = version
+        self.model_path = os.path.join(model_dir, version)
+        # The model is shared through the registry with other taggers of the same version
+        self.nlp = acquire_spacy_model(self.model_path)
+        # Only the components needed for doc.ents are run
+        self.disabled_pipes = disabled_pipes(self.nlp)
+
+    @staticmethod
+    def _entities_from_doc(doc) -> dict:
+        return {ent.text: ent.label_ for ent in doc.ents}
+
+    def tag(self, text: str) -> dict:
+        """Returns the entities of the text as a dictionary of entity text -> entity label"""
+        return self._entities_from_doc(self.nlp(text, disable=self.disabled_pipes))
+
+    def tag_many(self, texts: Iterable[str], batch_size: int = 64, n_process: int = 1) -> Iterator[dict]:
+        """Yields the entities of each text (see tag), running the texts through nlp.pipe in batches"""
+        for doc in self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=self.disabled_pipes):
+            yield self._entities_from_doc(doc)
+
+    def release_models(self, unload: bool = False):
+        """Releases the model from the registry, unloading it if unload is True and no other tagger uses it"""
+        release_spacy_model(self.model_path, unload)
+
+
+def ner_analysis(text: str = "Apple Inc. was founded by Steve Jobs in Cupertino",
+                 model_dir: str = DEFAULT_NER_MODEL_DIR) -> dict:
+    """
+    Tags the text with the custom NER model, training the model on the example data if no model has been trained yet
+    """
+    if latest_ner_model_version(model_dir) is None:
+        train_ner_model(EXAMPLE_TRAIN_DATA, model_dir)
+    return CustomNerTagger(model_dir).tag(text)
 
-    # Save the trained model
-    nlp.to_disk("ner_model")
 
-    # Load the trained model
-    loaded_nlp = spacy.load("ner_model")
+if __name__ == '__main__':
+    logging.basicConfig(encoding='utf-8', level=logging.INFO)
 
-    # Example of using the trained model on new data
-    # new_text = "Tesla employees went on vacation with Air Canada."
-    new_text = "Apple Inc. was founded by Steve Jobs in Cupertino"
-    doc = loaded_nlp(new_text)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train_data", type=str, default=None,
+                        help="The path to the JSON lines file of training examples, each of the form "
+                             '{"text": ..., "entities": [[start, end, label], ...]}. Default is the example data')
+    parser.add_argument("--output_dir", type=str, default=DEFAULT_NER_MODEL_DIR,
+                        help=f"The folder the trained model versions are saved to. Default {DEFAULT_NER_MODEL_DIR}")
+    parser.add_argument("--base_model", type=str, default="en_core_web_sm",
+                        help="The spaCy pipeline whose NER component is trained. Default en_core_web_sm")
+    parser.add_argument("--epochs", type=int, default=10, help="The number of training epochs. Default 10")
+    parser.add_argument("--seed", type=int, default=0, help="The seed used to shuffle the training data. Default 0")
+    args = parser.parse_args()
 
-    results = {}
-    # Print the entities in the new text
-    for ent in doc.ents:
-        print(ent.text, ent.label_)
-        results[ent.text] = ent.label_
-    return results
+    training_data = EXAMPLE_TRAIN_DATA if args.train_data is None else load_training_data(args.train_data)
+    train_ner_model(training_data, args.output_dir, args.base_model, args.epochs, seed=args.seed)
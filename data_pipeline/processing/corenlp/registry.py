@@ -0,0 +1,100 @@
+"""
+Process wide registry of the models used by the corenlp classes.
+Several corenlp classes (and several instances of the same class) use the same models, e.g. EsgTextClassification
+and EsgKeywordExtractor both use yiyanghkust/finbert-esg. The registry loads each model once per process and hands out
+the same loaded model to every user, counting the references so that models that are no longer used can be unloaded.
+"""
+import logging
+import threading
+from typing import Callable, Hashable
+
+from .backends import load_sequence_classifier
+
+logger = logging.getLogger("corenlp_registry")
+
+
+class ModelRegistry:
+    """
+    Holds one loaded instance of each model, keyed by a hashable key, with a count of the references to it
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._ref_counts = {}
+        # Loading is done under the lock so that two threads asking for the same model do not both load it
+        self._lock = threading.RLock()
+
+    def acquire(self, key: Hashable, loader: Callable):
+        """
+        Returns the model for the key, loading it with the loader if it is not already loaded, and adds a reference
+        """
+        with self._lock:
+            if key not in self._models:
+                logger.info(f"Loading model {key}")
+                self._models[key] = loader()
+                self._ref_counts[key] = 0
+            self._ref_counts[key] += 1
+            return self._models[key]
+
+    def release(self, key: Hashable, unload: bool = False):
+        """
+        Removes a reference to the model for the key.
+        If unload is True and there are no references left, the model is removed from the registry
+        """
+        with self._lock:
+            if key not in self._models:
+                return
+            self._ref_counts[key] = max(0, self._ref_counts[key] - 1)
+            if unload and self._ref_counts[key] == 0:
+                self._unload(key)
+
+    def unload_unused(self) -> int:
+        """Removes the models with no references from the registry and returns the number of models removed"""
+        with self._lock:
+            unused = [key for key, count in self._ref_counts.items() if count == 0]
+            for key in unused:
+                self._unload(key)
+            return len(unused)
+
+    def _unload(self, key: Hashable):
+        logger.info(f"Unloading model {key}")
+        del self._models[key]
+        del self._ref_counts[key]
+
+    def loaded_models(self) -> dict:
+        """Returns the keys of the loaded models and the number of references to each"""
+        with self._lock:
+            return dict(self._ref_counts)
+
+
+# The registry shared by all the corenlp classes in the process
+model_registry = ModelRegistry()
+
+
+def _sequence_classifier_key(model_name: str, backend: str, revision: str = None):
+    return "sequence-classification", model_name, revision, backend
+
+
+def acquire_sequence_classifier(model_name: str, backend: str = "torch", revision: str = None):
+    """
+    Returns the shared tokenizer and model for a HuggingFace sequence classification model (see
+    backends.load_sequence_classifier), loading it if this is the first use of the (name, revision, backend)
+    """
+    return model_registry.acquire(_sequence_classifier_key(model_name, backend, revision),
+                                  lambda: load_sequence_classifier(model_name, backend, revision=revision))
+
+
+def release_sequence_classifier(model_name: str, backend: str = "torch", revision: str = None, unload: bool = False):
+    """Releases a reference to a sequence classification model returned by acquire_sequence_classifier"""
+    model_registry.release(_sequence_classifier_key(model_name, backend, revision), unload)
+
+
+def acquire_spacy_model(name: str):
+    """Returns the shared spaCy pipeline loaded from the name or path"""
+    import spacy
+    return model_registry.acquire(("spacy", name), lambda: spacy.load(name))
+
+
+def release_spacy_model(name: str, unload: bool = False):
+    """Releases a reference to a spaCy pipeline returned by acquire_spacy_model"""
+    model_registry.release(("spacy", name), unload)
@@ -0,0 +1,250 @@
+"""
+Cache of the predictions of the corenlp classification and sentiment models.
+News articles are syndicated across many sites and contain boilerplate paragraphs (company descriptions, cookie
+banners, disclaimers) so the same texts are classified many times. The probabilities predicted for a text are cached
+in two tiers, an in-process LRU and an on-disk SQLite table, keyed by the model name, the model revision and the hash
+of the normalised text. Cached texts are served without being tokenized or passed to the model.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+DEFAULT_MAX_MEMORY_ENTRIES = 100000
+DEFAULT_MAX_DISK_ENTRIES = 2000000
+# Files holding the weights of a model saved in a local folder
+WEIGHTS_FILE_EXTENSIONS = (".safetensors", ".bin", ".onnx", ".pt", ".h5")
+
+
+def normalize_text(text: str) -> str:
+    """Normalises the whitespace in a text, which does not change how the text is tokenized"""
+    return " ".join(text.split())
+
+
+def text_hash(text: str) -> str:
+    """Returns the hash of the normalised text used as the cache key"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _local_weights_signature(model_path: str) -> str:
+    """
+    Returns a hash of the names, sizes and modification times of the weights files of a model saved in a local folder,
+    which changes when the model is retrained or replaced at the same path
+    """
+    weights = []
+    if os.path.isdir(model_path):
+        for file_name in sorted(os.listdir(model_path)):
+            if file_name.endswith(WEIGHTS_FILE_EXTENSIONS):
+                stat = os.stat(os.path.join(model_path, file_name))
+                weights.append(f"{file_name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("|".join(weights).encode("utf-8")).hexdigest()[:16]
+
+
+def model_cache_key(model, backend: str = "torch") -> Tuple[str, str]:
+    """
+    Returns the (model name, model revision) of a HuggingFace model used in the cache key.
+    The revision is the commit of the model on the HuggingFace Hub (or for a model loaded from a local folder, a
+    signature of its weights files) and the backend used to run it, since the backends can give slightly different
+    probabilities
+    """
+    config = model.config
+    revision = getattr(config, "_commit_hash", None) or f"local-{_local_weights_signature(config.name_or_path)}"
+    # Models run by the inference service are run with the backend of the service
+    backend = getattr(model, "backend", backend)
+    return config.name_or_path, f"{revision}/{backend}"
+
+
+class ResultCache:
+    """
+    Two tier (in-process LRU and on-disk SQLite) cache of the probabilities predicted by a model for a text.
+    Params:
+        db_path: path to the SQLite database file used for the on-disk tier. If None, only the in-process tier is used
+        max_memory_entries: the maximum number of predictions kept in the in-process LRU
+        max_disk_entries: the maximum number of predictions kept on disk, the least recently used are evicted
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES,
+                 max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES):
+        self.log = logging.getLogger("ResultCache")
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.conn = None
+        self._disk_entries = 0
+        if db_path is not None:
+            self.conn = sqlite3.connect(db_path, timeout=60)
+            self._create_tables()
+            cur = self.conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM model_results")
+            self._disk_entries = cur.fetchone()[0]
+            cur.close()
+
+    def _create_tables(self):
+        cur = self.conn.cursor()
+        cur.execute("""CREATE TABLE IF NOT EXISTS model_results (
+                            model_name text NOT NULL,
+                            model_revision text NOT NULL,
+                            text_hash text NOT NULL,
+                            num_labels integer NOT NULL,
+                            probs blob NOT NULL,
+                            last_used real NOT NULL,
+                            PRIMARY KEY (model_name, model_revision, text_hash)
+                        )""")
+        cur.execute("CREATE INDEX IF NOT EXISTS model_results_last_used ON model_results(last_used)")
+        self.conn.commit()
+        cur.close()
+
+    def _remember(self, key, probs: np.ndarray):
+        self._memory[key] = probs
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model_key: Tuple[str, str], hashes: List[str],
+                 num_labels: int = None) -> List[Optional[np.ndarray]]:
+        """
+        Returns the cached probabilities for each of the text hashes for the model, or None if not cached
+        Params:
+            model_key: the (model name, model revision) of the model, see model_cache_key
+            hashes: the hashes of the texts, see text_hash
+            num_labels: the number of labels of the model, cached probabilities for another number of labels are
+                treated as not cached
+        """
+        results = [None] * len(hashes)
+        disk_lookups = {}
+        for idx, hash_value in enumerate(hashes):
+            key = model_key + (hash_value,)
+            if key in self._memory and (num_labels is None or len(self._memory[key]) == num_labels):
+                self._memory.move_to_end(key)
+                results[idx] = self._memory[key]
+                self.memory_hits += 1
+            else:
+                disk_lookups.setdefault(hash_value, []).append(idx)
+
+        if self.conn is not None and len(disk_lookups) > 0:
+            found = self._get_from_disk(model_key, list(disk_lookups.keys()), num_labels)
+            for hash_value, probs in found.items():
+                self._remember(model_key + (hash_value,), probs)
+                for idx in disk_lookups.pop(hash_value):
+                    results[idx] = probs
+                    self.disk_hits += 1
+
+        self.misses += sum(len(indexes) for indexes in disk_lookups.values())
+        return results
+
+    def _get_from_disk(self, model_key: Tuple[str, str], hashes: List[str], num_labels: int = None,
+                       chunk_size: int = 500) -> dict:
+        found = {}
+        cur = self.conn.cursor()
+        # SQLite limits the number of parameters in a query so the hashes are looked up in chunks
+        for start in range(0, len(hashes), chunk_size):
+            chunk = hashes[start:start + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            cur.execute(f"""SELECT text_hash, num_labels, probs FROM model_results
+                            WHERE model_name = ? AND model_revision = ? AND text_hash IN ({placeholders})""",
+                        model_key + tuple(chunk))
+            for hash_value, row_num_labels, probs in cur.fetchall():
+                if num_labels is not None and row_num_labels != num_labels:
+                    continue
+                found[hash_value] = np.frombuffer(probs, dtype=np.float32).copy()
+        if len(found) > 0:
+            now = time.time()
+            cur.executemany("""UPDATE model_results SET last_used = ?
+                               WHERE model_name = ? AND model_revision = ? AND text_hash = ?""",
+                            [(now,) + model_key + (hash_value,) for hash_value in found])
+            self.conn.commit()
+        cur.close()
+        return found
+
+    def put_many(self, model_key: Tuple[str, str], hashes: List[str], probs: np.ndarray):
+        """Stores the probabilities (texts x labels) predicted by the model for each of the text hashes"""
+        probs = np.asarray(probs, dtype=np.float32)
+        for hash_value, row in zip(hashes, probs):
+            self._remember(model_key + (hash_value,), row.copy())
+
+        if self.conn is None or len(hashes) == 0:
+            return
+        now = time.time()
+        cur = self.conn.cursor()
+        cur.executemany("""INSERT OR REPLACE INTO model_results(model_name, model_revision, text_hash, num_labels,
+                                probs, last_used)
+                           VALUES(?, ?, ?, ?, ?, ?)""",
+                        [model_key + (hash_value, len(row), row.tobytes(), now) for hash_value, row in
+                         zip(hashes, probs)])
+        self._disk_entries += len(set(hashes))
+        if self._disk_entries > self.max_disk_entries:
+            self._evict(cur)
+        self.conn.commit()
+        cur.close()
+
+    def _evict(self, cur: sqlite3.Cursor):
+        # Replaced rows are counted as new rows when stored, so recount before evicting
+        cur.execute("SELECT COUNT(*) FROM model_results")
+        self._disk_entries = cur.fetchone()[0]
+        if self._disk_entries <= self.max_disk_entries:
+            return
+        # Evict down to 90% of the maximum so that eviction is not needed on every store
+        num_evict = self._disk_entries - int(self.max_disk_entries * 0.9)
+        cur.execute("""DELETE FROM model_results WHERE rowid IN (
+                            SELECT rowid FROM model_results ORDER BY last_used LIMIT ?)""", (num_evict,))
+        self._disk_entries -= num_evict
+        self.log.info(f"Evicted {num_evict} least recently used results from the result cache")
+
+    def stats(self) -> dict:
+        """Returns the hit counters and hit rate of the cache"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups > 0 else 0.0,
+                "memory_entries": len(self._memory), "disk_entries": self._disk_entries}
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def cached_inference(cache: Optional[ResultCache], model_key: Tuple[str, str], texts, num_labels: int,
+                     run_inference: Callable[[List[str]], torch.Tensor]) -> torch.Tensor:
+    """
+    Returns the probabilities (texts x labels) of the texts, running the model only on texts that are not cached.
+    Params:
+        cache: the result cache, if None the model is run on all the texts
+        model_key: the (model name, model revision) of the model, see model_cache_key
+        texts: a string or list of strings
+        num_labels: the number of labels of the model
+        run_inference: function that runs the model on a list of texts and returns their probabilities
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    if cache is None:
+        return run_inference(texts)
+
+    hashes = [text_hash(text) for text in texts]
+    cached = cache.get_many(model_key, hashes, num_labels)
+    predictions = torch.zeros((len(texts), num_labels))
+    # Texts that occur more than once in the list are only run once
+    missing = {}
+    for idx, (hash_value, probs) in enumerate(zip(hashes, cached)):
+        if probs is not None:
+            predictions[idx] = torch.from_numpy(probs)
+        else:
+            missing.setdefault(hash_value, []).append(idx)
+
+    if len(missing) > 0:
+        first_idx = [indexes[0] for indexes in missing.values()]
+        missing_preds = run_inference([texts[idx] for idx in first_idx])
+        cache.put_many(model_key, list(missing.keys()), missing_preds.numpy())
+        for indexes, probs in zip(missing.values(), missing_preds):
+            predictions[indexes] = probs
+    return predictions
@@ -0,0 +1,80 @@
+"""
+Array results of the corenlp classification and sentiment models.
+The predictions of a model for a list of texts are kept as a NumPy (texts x labels) probability matrix with the label
+vocabulary of the model, rather than as a sorted list of dictionaries per text. Top-k labels are computed on the whole
+matrix and the list of dictionaries format returned by the classifiers is available as a view for existing callers.
+"""
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+
+def label_vocabulary(id2label) -> np.ndarray:
+    """Returns the labels of a HuggingFace model config (id2label) as an array ordered by label index"""
+    return np.array([id2label[idx] for idx in range(len(id2label))], dtype=object)
+
+
+class ClassificationResult:
+    """
+    The probabilities of each label for a set of texts.
+    Params:
+        probs: the (texts x labels) probability matrix
+        labels: the label of each column of the probability matrix
+    """
+
+    def __init__(self, probs, labels):
+        if isinstance(probs, torch.Tensor):
+            probs = probs.numpy()
+        self.probs = np.asarray(probs)
+        self.labels = np.asarray(labels, dtype=object)
+
+    def __len__(self):
+        return self.probs.shape[0]
+
+    def ranking(self) -> np.ndarray:
+        """
+        Returns the (texts x labels) label indexes of each text ordered from the most to the least likely.
+        Labels with the same probability keep their label order
+        """
+        return np.argsort(-self.probs, axis=1, kind="stable")
+
+    def top_k(self, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the (texts x k) labels and probabilities of the k most likely labels of each text"""
+        top_idx = self.ranking()[:, :k]
+        return self.labels[top_idx], np.take_along_axis(self.probs, top_idx, axis=1)
+
+    def top_labels(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the most likely label of each text and its probability"""
+        top_idx = self.probs.argmax(axis=1)
+        return self.labels[top_idx], self.probs[np.arange(len(self)), top_idx]
+
+    def map_labels(self, mapping: np.ndarray, labels) -> "ClassificationResult":
+        """
+        Returns the result with the probabilities of the labels combined into a new set of labels.
+        Params:
+            mapping: the (labels x new labels) matrix, where mapping[i, j] is 1 if label i is part of new label j
+            labels: the new labels
+        """
+        return ClassificationResult(self.probs.astype(np.float64) @ mapping, labels)
+
+    def to_label_dicts(self) -> List[List[dict]]:
+        """
+        Returns the list of dictionaries view of the result, as returned by the classifiers:
+        for each text, the labels ordered from most to least likely as {"label": label, "prob": probability}
+        """
+        ranking = self.ranking()
+        ranked_labels = self.labels[ranking].tolist()
+        ranked_probs = np.take_along_axis(self.probs, ranking, axis=1).tolist()
+        return [[{"label": label, "prob": prob} for label, prob in zip(labels, probs)]
+                for labels, probs in zip(ranked_labels, ranked_probs)]
+
+    def to_label_tuples(self) -> List[List[Tuple[str, float]]]:
+        """
+        Returns the list of tuples view of the result, as returned by the sentiment analysis:
+        for each text, the labels ordered from most to least likely as (label, probability)
+        """
+        ranking = self.ranking()
+        ranked_labels = self.labels[ranking].tolist()
+        ranked_probs = np.take_along_axis(self.probs, ranking, axis=1).tolist()
+        return [list(zip(labels, probs)) for labels, probs in zip(ranked_labels, ranked_probs)]
@@ -0,0 +1,126 @@
+"""
+Single pass matching of a set of terms (words or phrases) in a text.
+The terms are held in a character trie and the text is scanned once from left to right, walking the trie from each
+word start, so the time taken depends on the length of the text rather than on the number of terms. Matching is case
+insensitive and only whole words match, i.e. a term must be preceded and followed by the start/end of the text or by
+a non-word character.
+"""
+from typing import Any, Iterable, List, Tuple
+
+# Key of the trie node entry holding the value of the term that ends at the node. Never a character of a term
+_TERM_END = ""
+
+
+def _fold(char: str) -> str:
+    """Lower cases a character, keeping the characters whose lower case is more than one character as they are"""
+    lower = char.lower()
+    return lower if len(lower) == 1 else char
+
+
+def _is_word_char(char: str) -> bool:
+    """Whether the character is matched by the regular expression \\w"""
+    return char.isalnum() or char == "_"
+
+
+class TermTrie:
+    """
+    Character trie of a set of terms, each with an optional value returned when the term is matched.
+    Params:
+        terms: the terms to match. Empty and None terms are ignored
+    """
+
+    def __init__(self, terms: Iterable[str] = None):
+        self._root = {}
+        self._num_terms = 0
+        for term in terms or []:
+            self.add(term)
+
+    def __len__(self):
+        return self._num_terms
+
+    def add(self, term: str, value: Any = None):
+        """Adds a term to the trie. The value defaults to the term itself"""
+        if not term:
+            return
+        node = self._root
+        for char in term:
+            node = node.setdefault(_fold(char), {})
+        if _TERM_END not in node:
+            self._num_terms += 1
+        node[_TERM_END] = term if value is None else value
+
+    def _find_node(self, term: str):
+        node = self._root
+        for char in term:
+            node = node.get(_fold(char))
+            if node is None:
+                return None
+        return node
+
+    def get(self, term: str, default: Any = None) -> Any:
+        """Returns the value of the term (matched ignoring case) or the default if the term is not in the trie"""
+        node = self._find_node(term) if term else None
+        if node is None:
+            return default
+        return node.get(_TERM_END, default)
+
+    def remove(self, term: str):
+        """Removes a term from the trie, pruning the nodes that no longer lead to a term"""
+        if not term:
+            return
+        path = [self._root]
+        for char in term:
+            node = path[-1].get(_fold(char))
+            if node is None:
+                return
+            path.append(node)
+        if _TERM_END not in path[-1]:
+            return
+        del path[-1][_TERM_END]
+        self._num_terms -= 1
+        for parent, char, node in zip(reversed(path[:-1]), reversed(term), reversed(path[1:])):
+            if len(node) > 0:
+                break
+            del parent[_fold(char)]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, Any]]:
+        """
+        Returns the (start, end, value) of the terms found in the text, scanning from left to right.
+        Where several terms match at the same position the longest is used, and matches do not overlap
+        """
+        matches = []
+        root = self._root
+        text_len = len(text)
+        idx = 0
+        while idx < text_len:
+            # Terms only match from the start of a word and the first character must start a term
+            if (idx > 0 and _is_word_char(text[idx - 1])) or _fold(text[idx]) not in root:
+                idx += 1
+                continue
+            node = root
+            match = None
+            end = idx
+            while end < text_len:
+                node = node.get(_fold(text[end]))
+                if node is None:
+                    break
+                end += 1
+                if _TERM_END in node and (end == text_len or not _is_word_char(text[end])):
+                    match = (idx, end, node[_TERM_END])
+            if match is None:
+                idx += 1
+            else:
+                matches.append(match)
+                idx = match[1]
+        return matches
+
+    def replace(self, text: str, replacement: str = " ") -> str:
+        """Returns the text with each of the terms found replaced by the replacement"""
+        pieces = []
+        last_end = 0
+        for start, end, _ in self.find_all(text):
+            pieces.append(text[last_end:start])
+            pieces.append(replacement)
+            last_end = end
+        pieces.append(text[last_end:])
+        return "".join(pieces)
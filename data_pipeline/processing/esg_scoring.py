@@ -3,6 +3,10 @@ Wrapper script to run the ESG Scoring script to process sustainability reports a
 The ESG Scorer takes a path to the Sustainability Reports, processes them and generates the scores.
 This script calls the ESG Scorer and based on the returned scores, updates the insights.db with the ESG Scores
 
+Scoring is incremental: the features of each report are stored in the insights.db keyed by the organisation and
+the hash of the report, so only new or changed reports are classified. The percentile scores of every organisation
+are then recomputed from the stored features extracted with the current page selection settings.
+
 ToDo: The ESG Scorer code is provided as is from the work stream and has not been optimised or refactored
     into a clean architecture - this needs to be done at a later date
 """
@@ -14,7 +18,11 @@ import argparse
 
 import pandas as pd
 
-from esgscoring.scoring import scorer
+from esgscoring.scoring import extract_features, rank_features
+from esgscoring.page_store import PageTextStore, DEFAULT_PAGE_STORE_NAME, hash_file
+from esgscoring.page_filter import EsgPageFilter, DEFAULT_KEYWORDS_PATH
+from esgscoring.feature_store import (create_report_features_table, has_report_features, store_report_features,
+                                      get_latest_report_features)
 
 logger = logging.getLogger("esg_scoring")
 
@@ -96,10 +104,36 @@ def update_esg_scores_for_org(conn, org_id, E1, E2, E3, S1, S2, S3, G1, G2, E, S
 
     cur = conn.cursor()
     cur.execute(sql, (org_id, timestamp, E1, E2, E3, S1, S2, S3, G1, G2, E, S, G, ESG))
-    cur.commit()
+    conn.commit()
     cur.close()
 
 
+def find_reports_to_score(conn: sqlite3.Connection, data_folder: str, rescore_all: bool = False,
+                          feature_version: str = "") -> list:
+    """
+    Matches the reports in the data folder to organisations and returns those that have not been scored before,
+    i.e. whose features are not stored for the organisation with the feature version (the signature of the page
+    filter used to select the pages to classify). If rescore_all is True all matched reports are returned.
+    Returns:
+        List of (org_id, report_hash, report_name, file_path) tuples
+    """
+    reports = []
+    for file in os.listdir(data_folder):
+        report_name = file.replace('.pdf', '')
+        org_id, org_name = find_org_by_alias(conn, report_name)
+        if org_id is None:
+            logger.warning(f"Unable to match the company name '{report_name}' "
+                           " to an organisation within the Insights Database")
+            continue
+        file_path = os.path.join(data_folder, file)
+        report_hash = hash_file(file_path)
+        if not rescore_all and has_report_features(conn, org_id, report_hash, feature_version):
+            continue
+        logger.info(f"Matched report '{report_name}' to Organisation {org_id} - {org_name}")
+        reports.append((org_id, report_hash, report_name, file_path))
+    return reports
+
+
 if __name__ == '__main__':
     logging.basicConfig(encoding='utf-8', level=logging.INFO)
 
@@ -116,7 +150,25 @@ if __name__ == '__main__':
                         help="The weighting to apply to Social scores in the overall ESG score. Default 0.30")
     parser.add_argument("--weight_g", type=float, default=0.25,
                         help="The weighting to apply to Governance scores in the overall ESG score. Default 0.25")
-    
+    parser.add_argument("--page_store", type=str, default=None,
+                        help="The path to the database used to store the text extracted from the report pages. "
+                             f"Default is '{DEFAULT_PAGE_STORE_NAME}' in the same folder as the insights database")
+    parser.add_argument("--batch_size", type=int, default=32,
+                        help="The number of report pages to classify in each batch. Default 32")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="The number of worker processes used to extract and classify the reports. Default 1")
+    parser.add_argument("--page_keywords", type=str, default=DEFAULT_KEYWORDS_PATH,
+                        help="The path to the JSON file of the ESG keywords used to select the report pages to classify. "
+                             "Default is esgscoring/esg_page_keywords.json")
+    parser.add_argument("--max_pages_per_report", type=int, default=None,
+                        help="The maximum number of pages to classify per report, keeping the pages with the highest "
+                             "ESG keyword density. Default is no limit")
+    parser.add_argument("--rescore_all", action="store_true",
+                        help="Re-extract the features of every report, not only the new or changed reports")
+    parser.add_argument("--inference_service", type=str, default=None,
+                        help="The url of the local inference service (e.g. http://127.0.0.1:8765) used to run the "
+                             "classifiers. Default is to load the models in this process")
+
     args = parser.parse_args()
 
     if args.data_folder is None or not os.path.exists(args.data_folder):
@@ -128,23 +180,39 @@ if __name__ == '__main__':
 
     insights_db_conn = sqlite3.connect(args.insight_db)
 
-    # Call the ESG Scoring function to score the documents based on the contents of the folder
-    companies, E1, E2, E3, S1, S2, S3, G1, G2, E, S, G, ESG = scorer(args.weight_e, args.weight_s, args.weight_g,
-                                                                     args.data_folder)
+    page_store_path = args.page_store
+    if page_store_path is None:
+        page_store_path = os.path.join(os.path.dirname(os.path.abspath(args.insight_db)), DEFAULT_PAGE_STORE_NAME)
+    page_store = PageTextStore(page_store_path)
+
+    # Step 1: extract and store the features of the reports that are new or have changed since the last run
+    create_report_features_table(insights_db_conn)
+    # Reports whose features were extracted with other page selection settings are re-extracted
+    page_filter = EsgPageFilter.from_file(args.page_keywords, max_pages=args.max_pages_per_report)
+    feature_version = page_filter.signature()
+    reports = find_reports_to_score(insights_db_conn, args.data_folder, args.rescore_all, feature_version)
+    logger.info(f"{len(reports)} new or changed reports to be scored")
+    if len(reports) > 0:
+        features = extract_features([file_path for _, _, _, file_path in reports], page_store=page_store,
+                                    batch_size=args.batch_size, workers=args.workers, page_filter=page_filter,
+                                    service_url=args.inference_service,
+                                    file_hashes=[report_hash for _, report_hash, _, _ in reports])
+        for (org_id, report_hash, report_name, file_path), report_features in zip(reports, features):
+            # The modification time of the report decides which report of an organisation is the latest
+            report_date = datetime.datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y%m%d%H%M%S")
+            store_report_features(insights_db_conn, org_id, report_hash, report_name, report_features,
+                                  feature_version, report_date)
+    page_store.close()
+
+    # Step 2: re-rank every organisation from the stored features of its latest report, with the current settings
+    org_ids, features = get_latest_report_features(insights_db_conn, feature_version)
+    E1, E2, E3, S1, S2, S3, G1, G2, E, S, G, ESG = rank_features(args.weight_e, args.weight_s, args.weight_g,
+                                                                 features)
 
     # Store these resulting scores in the Insights database
-    for idx in range(len(companies)):
-        # Need to attempt to find the relevant company name and id
-        org_id, org_name = find_org_by_alias(insights_db_conn, companies[idx])
-        if org_id is None:
-            logger.warning(f"Unable to match the company name '{companies[idx]}' "
-                           " to an organisation within the Insights Database")
-            # Skip update
-            continue
-        logger.info(f"Matched scored Company '{companies[idx]}' to Organisation {org_id} - {org_name}")
-
-        # Store the results
+    for idx, org_id in enumerate(org_ids):
         update_esg_scores_for_org(insights_db_conn, org_id, E1[idx], E2[idx], E3[idx],
                                   S1[idx], S2[idx], S3[idx],
                                   G1[idx], G2[idx],
                                   E[idx], S[idx], G[idx], ESG[idx])
+    logger.info(f"Updated the ESG Scores of {len(org_ids)} organisations")
@@ -0,0 +1,252 @@
+"""
+Benchmark for the ESG Scoring pipeline.
+Builds a deterministic synthetic corpus of Sustainability Report PDFs and times each stage of the scorer:
+EOF repair, text extraction, keyword page selection, classification and percentile ranking.
+The FinBERT models are replaced with tiny randomly initialised BERT models with the same labels, so the benchmark
+runs offline and measures the pipeline rather than the size of the models.
+The results are written as JSON so that runs can be compared over time.
+
+Run from the data_pipeline/processing folder:
+    python -m esgscoring.benchmark --num_reports 100 --output ./esg_scoring_benchmark.json
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import platform
+import random
+import tempfile
+import time
+from datetime import datetime
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+from corenlp.classification import EsgTextClassification
+from file_processing.sustainability_reports import find_pdf_end, open_pdf_reader
+from .features import BROAD_CATEGORIES, ESG_TOPICS, report_feature_matrix
+from .scoring import classify_pages, rank_features, select_esg_pages
+
+logger = logging.getLogger("esg_scoring_benchmark")
+
+FOCUS_TERMS = ["Environmental", "Social", "Governance"]
+ESG_WORDS = ["emissions", "climate", "carbon", "renewable", "biodiversity", "water", "waste", "pollution",
+             "employees", "diversity", "safety", "community", "customers", "product", "board", "ethics",
+             "compliance", "directors", "remuneration", "audit"]
+FILLER_WORDS = ["the", "company", "group", "year", "report", "our", "we", "and", "of", "to", "in", "for", "with",
+                "revenue", "growth", "market", "operations", "strategy", "performance", "results", "financial",
+                "business", "continued", "increase", "new", "services", "investment", "customers", "total", "period"]
+WORDS_PER_LINE = 12
+
+
+def _pdf_object_bytes(obj_id: int, body: bytes) -> bytes:
+    return f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n"
+
+
+def make_pdf(pages) -> bytes:
+    """
+    Builds a minimal PDF with one page per item of pages, where each page is a list of lines of text.
+    The text must not contain the PDF string delimiters '(', ')' or '\\'
+    """
+    num_pages = len(pages)
+    font_id = 3 + 2 * num_pages
+    kids = " ".join(f"{3 + 2 * idx} 0 R" for idx in range(num_pages))
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{kids}] /Count {num_pages} >>".encode()]
+    for idx, lines in enumerate(pages):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * idx} 0 R >>".encode())
+        text = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 760 Td {text} ET".encode()
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for obj_idx, body in enumerate(objects):
+        offsets.append(len(pdf))
+        pdf += _pdf_object_bytes(obj_idx + 1, body)
+    xref_pos = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_pos}\n%%EOF\n".encode()
+    return bytes(pdf)
+
+
+def _make_page(rng: random.Random, words_per_page: int, esg_page: bool):
+    words = []
+    for _ in range(words_per_page):
+        words.append(rng.choice(ESG_WORDS) if esg_page and rng.random() < 0.2 else rng.choice(FILLER_WORDS))
+    if esg_page:
+        words[rng.randrange(len(words))] = rng.choice(FOCUS_TERMS)
+    return [" ".join(words[idx:idx + WORDS_PER_LINE]) for idx in range(0, len(words), WORDS_PER_LINE)]
+
+
+def build_corpus(corpus_dir: str, num_reports: int, min_pages: int = 10, max_pages: int = 40,
+                 words_per_page: int = 250, keyword_density: float = 0.3, eof_error_rate: float = 0.1,
+                 seed: int = 42) -> list[str]:
+    """
+    Builds a deterministic synthetic corpus of report PDFs.
+    Params:
+        corpus_dir: folder where the PDFs are written
+        num_reports: number of reports to generate
+        min_pages, max_pages: range of the number of pages of each report
+        words_per_page: number of words on each page
+        keyword_density: fraction of the pages that mention an ESG focus term
+        eof_error_rate: fraction of the reports with trailing data after the %%EOF marker
+        seed: seed of the random generator, the same seed always gives the same corpus
+    Returns:
+        The list of paths to the generated reports
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+    file_paths = []
+    for report_idx in range(num_reports):
+        num_pages = rng.randint(min_pages, max_pages)
+        pages = [_make_page(rng, words_per_page, rng.random() < keyword_density) for _ in range(num_pages)]
+        pdf = make_pdf(pages)
+        if rng.random() < eof_error_rate:
+            pdf += b"\n" * 16 + bytes(rng.randrange(256) for _ in range(2048))
+        file_path = os.path.join(corpus_dir, f"Company{report_idx:05d}.pdf")
+        with open(file_path, 'wb') as f:
+            f.write(pdf)
+        file_paths.append(file_path)
+    return file_paths
+
+
+def _make_stand_in_model(tokenizer, labels: list[str]):
+    config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=512, num_labels=len(labels),
+                        id2label=dict(enumerate(labels)), label2id={label: idx for idx, label in enumerate(labels)})
+    model = BertForSequenceClassification(config)
+    model.eval()
+    return model
+
+
+def make_stand_in_classifier(work_dir: str, seed: int = 42) -> EsgTextClassification:
+    """
+    Returns an EsgTextClassification that uses tiny randomly initialised BERT models with the FinBERT labels
+    in place of the FinBERT models, so that no models need to be downloaded
+    """
+    torch.manual_seed(seed)
+    vocab_file = os.path.join(work_dir, "vocab.txt")
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(
+        {word.lower() for word in FOCUS_TERMS + ESG_WORDS + FILLER_WORDS})
+    with open(vocab_file, 'w') as f:
+        f.write("\n".join(vocab))
+    tokenizer = BertTokenizerFast(vocab_file=vocab_file)
+
+    classifier = EsgTextClassification()
+    classifier.esg_course_classifier_tokenizer = tokenizer
+    classifier.esg_course_classifier_model = _make_stand_in_model(tokenizer, BROAD_CATEGORIES)
+    classifier.esg_fine_classifier_tokenizer = tokenizer
+    classifier.esg_fine_classifier_model = _make_stand_in_model(tokenizer, ESG_TOPICS)
+    return classifier
+
+
+def _stage_result(seconds: float, items: int, unit: str) -> dict:
+    return {"seconds": seconds, "items": items, "unit": unit,
+            "items_per_second": items / seconds if seconds > 0 else None}
+
+
+def run_benchmark(file_paths: list[str], classifier: EsgTextClassification, batch_size: int = 32) -> dict:
+    """Runs each stage of the scorer over the reports and returns the timings of each stage"""
+    stages = {}
+
+    start = time.perf_counter()
+    repaired = 0
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            repaired += find_pdf_end(buffer) < len(buffer)
+    stages["eof_repair"] = _stage_result(time.perf_counter() - start, len(file_paths), "reports")
+    stages["eof_repair"]["repaired"] = repaired
+
+    start = time.perf_counter()
+    reports = []
+    for file_path in file_paths:
+        with open_pdf_reader(file_path) as reader:
+            reports.append([page.extract_text() for page in reader.pages])
+    num_pages = sum(len(report) for report in reports)
+    stages["text_extraction"] = _stage_result(time.perf_counter() - start, num_pages, "pages")
+
+    start = time.perf_counter()
+    selected_texts = []
+    report_idx = []
+    for idx, report in enumerate(reports):
+        for page_idx in select_esg_pages(report):
+            selected_texts.append(report[page_idx])
+            report_idx.append(idx)
+    stages["keyword_page_selection"] = _stage_result(time.perf_counter() - start, num_pages, "pages")
+
+    start = time.perf_counter()
+    broad_category, esg_topic = classify_pages(classifier, selected_texts, batch_size)
+    stages["classification"] = _stage_result(time.perf_counter() - start, len(selected_texts), "pages")
+
+    start = time.perf_counter()
+    features = report_feature_matrix(report_idx, broad_category, esg_topic, len(reports))
+    rank_features(0.45, 0.30, 0.25, features)
+    stages["percentile_ranking"] = _stage_result(time.perf_counter() - start, len(reports), "reports")
+
+    return stages
+
+
+if __name__ == '__main__':
+    logging.basicConfig(encoding='utf-8', level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_reports", type=int, default=100,
+                        help="The number of synthetic reports in the corpus (10 to 10,000). Default 100")
+    parser.add_argument("--min_pages", type=int, default=10, help="The minimum number of pages of a report. Default 10")
+    parser.add_argument("--max_pages", type=int, default=40, help="The maximum number of pages of a report. Default 40")
+    parser.add_argument("--words_per_page", type=int, default=250,
+                        help="The number of words on each page. Default 250")
+    parser.add_argument("--keyword_density", type=float, default=0.3,
+                        help="The fraction of pages that mention an ESG focus term. Default 0.3")
+    parser.add_argument("--eof_error_rate", type=float, default=0.1,
+                        help="The fraction of reports with trailing data after the %%EOF marker. Default 0.1")
+    parser.add_argument("--batch_size", type=int, default=32,
+                        help="The number of pages to classify in each batch. Default 32")
+    parser.add_argument("--seed", type=int, default=42, help="The seed used to generate the corpus and models")
+    parser.add_argument("--corpus_dir", type=str, default=None,
+                        help="Folder to build the corpus in. Default is a temporary folder that is deleted afterwards")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path of the JSON results file. Default is esg_scoring_benchmark_<timestamp>.json")
+    args = parser.parse_args()
+
+    if not 10 <= args.num_reports <= 10000:
+        raise RuntimeError(f"The number of reports must be between 10 and 10,000. Value was {args.num_reports}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        corpus_dir = args.corpus_dir if args.corpus_dir is not None else os.path.join(work_dir, "reports")
+        corpus_config = {"num_reports": args.num_reports, "min_pages": args.min_pages, "max_pages": args.max_pages,
+                         "words_per_page": args.words_per_page, "keyword_density": args.keyword_density,
+                         "eof_error_rate": args.eof_error_rate, "seed": args.seed}
+        logger.info(f"Building synthetic corpus of {args.num_reports} reports in {corpus_dir}")
+        report_paths = build_corpus(corpus_dir, **corpus_config)
+
+        stand_in_classifier = make_stand_in_classifier(work_dir, seed=args.seed)
+        logger.info("Running benchmark")
+        start_time = time.perf_counter()
+        stage_results = run_benchmark(report_paths, stand_in_classifier, args.batch_size)
+        total_seconds = time.perf_counter() - start_time
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "config": dict(corpus_config, batch_size=args.batch_size),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "torch": torch.__version__, "torch_threads": torch.get_num_threads(),
+                        "cpu_count": os.cpu_count()},
+        "stages": stage_results,
+        "total_seconds": total_seconds,
+    }
+    output_path = args.output
+    if output_path is None:
+        output_path = f"esg_scoring_benchmark_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for stage, result in stage_results.items():
+        logger.info(f"{stage}: {result['seconds']:.3f}s for {result['items']} {result['unit']}")
+    logger.info(f"Benchmark results written to {output_path}")
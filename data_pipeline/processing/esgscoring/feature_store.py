@@ -0,0 +1,111 @@
+"""
+Stores the per-report ESG features in the insights database so that scoring can be done incrementally.
+Each Sustainability Report is classified once and its feature row (see features.FEATURE_COLUMNS) is stored keyed by
+the organisation and the hash of the report, with the version of the features (the settings used to select the
+pages that were classified). Features of another version are re-extracted. The ESG percentile scores can then be
+recomputed for the whole portfolio from the stored features of the current version without re-processing the reports.
+"""
+import logging
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+from .features import FEATURE_COLUMNS
+
+logger = logging.getLogger("esg_feature_store")
+
+
+def create_report_features_table(conn: sqlite3.Connection):
+    """Creates the organisations_esg_report_features table if it does not already exist"""
+    sql = """CREATE TABLE IF NOT EXISTS organisations_esg_report_features (
+                id integer PRIMARY KEY,
+                org_id integer NOT NULL,
+                report_hash text NOT NULL,
+                report_name text,
+                timestamp text NOT NULL,
+                num_features integer NOT NULL,
+                features blob NOT NULL,
+                feature_version text NOT NULL DEFAULT '',
+                report_date text,
+                UNIQUE (org_id, report_hash),
+                FOREIGN KEY (org_id) REFERENCES organisations(id)
+            )"""
+    cur = conn.cursor()
+    cur.execute(sql)
+    # Tables created by earlier versions do not have the feature_version and report_date columns
+    cur.execute("PRAGMA table_info(organisations_esg_report_features)")
+    columns = [row[1] for row in cur.fetchall()]
+    if "feature_version" not in columns:
+        cur.execute("ALTER TABLE organisations_esg_report_features ADD COLUMN feature_version text NOT NULL DEFAULT ''")
+    if "report_date" not in columns:
+        cur.execute("ALTER TABLE organisations_esg_report_features ADD COLUMN report_date text")
+    conn.commit()
+    cur.close()
+
+
+def has_report_features(conn: sqlite3.Connection, org_id: int, report_hash: str, feature_version: str = "") -> bool:
+    """Returns True if the features of the report have already been stored for the organisation with the version"""
+    sql = """SELECT id FROM organisations_esg_report_features
+             WHERE org_id = ? AND report_hash = ? AND feature_version = ?"""
+    cur = conn.cursor()
+    cur.execute(sql, (org_id, report_hash, feature_version))
+    row = cur.fetchone()
+    cur.close()
+    return row is not None
+
+
+def store_report_features(conn: sqlite3.Connection, org_id: int, report_hash: str, report_name: str,
+                          features: np.ndarray, feature_version: str = "", report_date: str = None):
+    """
+    Stores (or replaces) the feature row of a report for an organisation.
+    The report date (YYYYmmddHHMMSS) decides which is the latest report of the organisation
+    """
+    sql = """INSERT OR REPLACE INTO organisations_esg_report_features(org_id, report_hash, report_name, timestamp,
+                num_features, features, feature_version, report_date)
+             VALUES(?, ?, ?, ?, ?, ?, ?, ?)"""
+    features = np.asarray(features, dtype=np.float32).reshape(-1)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    cur = conn.cursor()
+    cur.execute(sql, (org_id, report_hash, report_name, timestamp, len(features), features.tobytes(),
+                      feature_version, report_date))
+    conn.commit()
+    cur.close()
+
+
+def get_latest_report_features(conn: sqlite3.Connection, feature_version: str = ""):
+    """
+    Returns the features of the latest report of each organisation, from the features stored with the version.
+    The latest report is the one with the latest report date, then the latest report name and hash, so it does not
+    depend on the order the reports were stored in. Organisations that only have features of other versions are
+    skipped, since features extracted with other page selection settings are not comparable.
+    Returns:
+        The list of organisation ids and the (organisations x FEATURE_COLUMNS) float32 feature matrix
+    """
+    sql = """SELECT org_id, num_features, features FROM organisations_esg_report_features
+             WHERE feature_version = ?
+             ORDER BY org_id, report_date IS NOT NULL, report_date, report_name, report_hash"""
+    cur = conn.cursor()
+    cur.execute(sql, (feature_version,))
+    # The rows of each organisation are ordered oldest first, so the last row of each organisation is kept
+    rows = list({org_id: (org_id, num_features, feature_bytes)
+                 for org_id, num_features, feature_bytes in cur.fetchall()}.values())
+    cur.execute("""SELECT DISTINCT org_id FROM organisations_esg_report_features
+                   WHERE org_id NOT IN (SELECT org_id FROM organisations_esg_report_features WHERE feature_version = ?)
+                   ORDER BY org_id""", (feature_version,))
+    outdated_org_ids = [org_id for org_id, in cur.fetchall()]
+    cur.close()
+    if len(outdated_org_ids) > 0:
+        logger.warning(f"Skipping {len(outdated_org_ids)} organisations whose reports were only scored with other page "
+                       f"selection settings, rescore their reports to include them: {outdated_org_ids}")
+
+    org_ids = []
+    features = np.zeros((len(rows), len(FEATURE_COLUMNS)), dtype=np.float32)
+    for org_id, num_features, feature_bytes in rows:
+        if num_features != len(FEATURE_COLUMNS):
+            logger.warning(f"Ignoring the stored features of organisation {org_id} since they were extracted "
+                           f"with {num_features} rather than {len(FEATURE_COLUMNS)} features")
+            continue
+        features[len(org_ids)] = np.frombuffer(feature_bytes, dtype=np.float32)
+        org_ids.append(org_id)
+    return org_ids, features[:len(org_ids)]
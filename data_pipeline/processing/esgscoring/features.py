@@ -0,0 +1,89 @@
+"""
+Builds the report x label feature matrix used for ESG scoring.
+Each classified page of a report contributes the probability of its top broad category and its top ESG topic.
+These are aggregated into one row per report holding the mean and max probability of every broad category and
+every FinBERT-ESG-9 topic (0.0 where no page of the report has that label)
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+from .ranking import PILLARS, TOPICS
+
+BROAD_CATEGORIES = PILLARS + ["None"]
+ESG_TOPICS = TOPICS + ["Non-ESG"]
+
+# Columns of the feature matrix: the mean of each label followed by the max of each label,
+# broad categories first and then ESG topics
+FEATURE_COLUMNS = ([f"{label}_mean" for label in BROAD_CATEGORIES] + [f"{label}_max" for label in BROAD_CATEGORIES] +
+                   [f"{label}_mean" for label in ESG_TOPICS] + [f"{label}_max" for label in ESG_TOPICS])
+PILLAR_MEAN_COLUMNS = [FEATURE_COLUMNS.index(f"{label}_mean") for label in PILLARS]
+TOPIC_MEAN_COLUMNS = [FEATURE_COLUMNS.index(f"{label}_mean") for label in TOPICS]
+
+
+def aggregate_labels(report_idx, labels: List[str], probs, n_reports: int, label_names: List[str],
+                     out: np.ndarray = None) -> np.ndarray:
+    """
+    Aggregates the top label and probability of each page into the mean and max probability of each label per report
+    using a single bincount over (report, label) cells rather than filtering the pages once per label.
+    Params:
+        report_idx: the index of the report each page belongs to
+        labels: the top label of each page. Labels not in label_names are ignored
+        probs: the probability of the top label of each page
+        n_reports: the number of reports (rows of the output)
+        label_names: the labels to aggregate
+        out: optional (n_reports x 2*len(label_names)) matrix to write into
+    Returns:
+        (n_reports x 2*len(label_names)) matrix of the mean of each label followed by the max of each label
+    """
+    n_labels = len(label_names)
+    if out is None:
+        out = np.zeros((n_reports, 2 * n_labels), dtype=np.float32)
+
+    label_lookup = {label: idx for idx, label in enumerate(label_names)}
+    label_idx = np.array([label_lookup.get(label, -1) for label in labels], dtype=np.int64)
+    report_idx = np.asarray(report_idx, dtype=np.int64).reshape(-1)
+    probs = np.asarray(probs, dtype=np.float64).reshape(-1)
+    known = label_idx >= 0
+    cells = report_idx[known] * n_labels + label_idx[known]
+    probs = probs[known]
+
+    counts = np.bincount(cells, minlength=n_reports * n_labels)
+    sums = np.bincount(cells, weights=probs, minlength=n_reports * n_labels)
+    means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    maxes = np.zeros(n_reports * n_labels, dtype=np.float64)
+    np.maximum.at(maxes, cells, probs)
+
+    out[:, :n_labels] = means.reshape(n_reports, n_labels)
+    out[:, n_labels:] = maxes.reshape(n_reports, n_labels)
+    return out
+
+
+def top_label_and_prob(classifications: List) -> Tuple[List[str], List[float]]:
+    """Returns the label and probability of the most likely label of each classification"""
+    labels = []
+    probs = []
+    for classification in classifications:
+        top = max(classification, key=lambda x: x['prob'])
+        labels.append(top['label'])
+        probs.append(top['prob'])
+    return labels, probs
+
+
+def report_feature_matrix(report_idx, broad_category: List, esg_topic: List, n_reports: int) -> np.ndarray:
+    """
+    Builds the (n_reports x len(FEATURE_COLUMNS)) float32 feature matrix from the classifications of the report pages.
+    Params:
+        report_idx: the index of the report each classified page belongs to
+        broad_category: the broad category classification of each page (as returned by is_esg_related)
+        esg_topic: the ESG topic classification of each page (as returned by get_esg_topic)
+        n_reports: the number of reports
+    """
+    features = np.zeros((n_reports, len(FEATURE_COLUMNS)), dtype=np.float32)
+    n_broad = 2 * len(BROAD_CATEGORIES)
+
+    labels, probs = top_label_and_prob(broad_category)
+    aggregate_labels(report_idx, labels, probs, n_reports, BROAD_CATEGORIES, out=features[:, :n_broad])
+    labels, probs = top_label_and_prob(esg_topic)
+    aggregate_labels(report_idx, labels, probs, n_reports, ESG_TOPICS, out=features[:, n_broad:])
+    return features
@@ -0,0 +1,74 @@
+"""
+Keyword pre-filter that selects the pages of a report to be classified by the ESG models.
+The keyword vocabulary (a JSON file mapping each ESG pillar to a list of terms) is compiled into a single alternation
+regex so each page is scanned once, and the number of keyword hits for each pillar is counted.
+Pages can then be ranked by keyword density and capped per report to limit the pages sent to the transformer models.
+"""
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List
+
+import numpy as np
+
+DEFAULT_KEYWORDS_PATH = os.path.join(os.path.dirname(__file__), "esg_page_keywords.json")
+
+
+class EsgPageFilter:
+    """
+    Selects the pages of a report that mention the ESG keywords.
+    Params:
+        vocabulary: dictionary mapping each ESG pillar to the list of terms that indicate the pillar
+        max_pages: if set, at most this many pages are selected per report, keeping the pages with the highest
+            keyword density (hits per 1,000 characters)
+        ignore_case: set to True to match the terms regardless of case. Default is False
+    """
+
+    def __init__(self, vocabulary: Dict[str, List[str]], max_pages: int = None, ignore_case: bool = False):
+        self.pillars = list(vocabulary.keys())
+        self.vocabulary = vocabulary
+        self.max_pages = max_pages
+        self.ignore_case = ignore_case
+        # One named group per pillar, with the longest terms first so that they take precedence over their prefixes
+        groups = []
+        for idx, pillar in enumerate(self.pillars):
+            terms = sorted(set(vocabulary[pillar]), key=len, reverse=True)
+            groups.append(f"(?P<pillar{idx}>{'|'.join(re.escape(term) for term in terms)})")
+        self.regex = re.compile("|".join(groups), flags=re.IGNORECASE if ignore_case else 0)
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_KEYWORDS_PATH, max_pages: int = None, ignore_case: bool = False):
+        """Creates the filter from a JSON keyword vocabulary file"""
+        with open(path) as f:
+            vocabulary = json.load(f)
+        return cls(vocabulary, max_pages=max_pages, ignore_case=ignore_case)
+
+    def signature(self) -> str:
+        """
+        Returns a hash of the filter settings (the keyword vocabulary, max_pages and ignore_case).
+        Features extracted with filters that have different signatures were extracted from different pages
+        """
+        settings = {"vocabulary": {pillar: sorted(set(terms)) for pillar, terms in self.vocabulary.items()},
+                    "max_pages": self.max_pages, "ignore_case": self.ignore_case}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def count_hits(self, text: str) -> np.ndarray:
+        """Returns the number of keyword hits in the text for each pillar"""
+        counts = np.zeros(len(self.pillars), dtype=np.int64)
+        for match in self.regex.finditer(text):
+            counts[match.lastindex - 1] += 1
+        return counts
+
+    def select_pages(self, report: List[str]) -> List[int]:
+        """
+        Returns the indexes (in page order) of the pages that contain at least one keyword.
+        If max_pages is set, only the max_pages pages with the highest keyword density are returned
+        """
+        if self.max_pages is None:
+            return [idx for idx, text in enumerate(report) if self.regex.search(text) is not None]
+
+        hits = [(idx, int(self.count_hits(text).sum()), len(text)) for idx, text in enumerate(report)]
+        hits = [(idx, 1000.0 * num_hits / max(num_chars, 1)) for idx, num_hits, num_chars in hits if num_hits > 0]
+        hits.sort(key=lambda x: x[1], reverse=True)
+        return sorted(idx for idx, _ in hits[:self.max_pages])
@@ -0,0 +1,87 @@
+"""
+Persistent store for the text extracted from the pages of Sustainability Report PDFs.
+Parsing large PDFs with PyPDF2 is by far the slowest part of ESG scoring, so the extracted text of each page is
+stored in a local SQLite database (normally stored next to the insights.db) keyed by the hash of the PDF contents.
+Reports that have not changed since the last scoring run are then served from the store without being parsed again.
+"""
+import hashlib
+import logging
+import sqlite3
+from datetime import datetime
+from typing import List, Optional
+
+DEFAULT_PAGE_STORE_NAME = "report_pages.db"
+
+
+def hash_file(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Returns the SHA-256 hash of the contents of a file, read in blocks so large PDFs are not loaded into memory"""
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+class PageTextStore:
+    """
+    Stores the text of each page of a PDF report keyed by the hash of the file contents.
+    Params:
+        db_path: path to the SQLite database file used for the store. The file is created if it does not exist
+    """
+
+    def __init__(self, db_path: str):
+        self.log = logging.getLogger("PageTextStore")
+        self.db_path = db_path
+        # Worker processes of the scorer share the store so wait for locks rather than failing
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self._create_tables()
+
+    def _create_tables(self):
+        cur = self.conn.cursor()
+        cur.execute("""CREATE TABLE IF NOT EXISTS report_files (
+                            file_hash text PRIMARY KEY,
+                            num_pages integer NOT NULL,
+                            timestamp text NOT NULL
+                        )""")
+        cur.execute("""CREATE TABLE IF NOT EXISTS report_pages (
+                            file_hash text NOT NULL,
+                            page_idx integer NOT NULL,
+                            page_text text NOT NULL,
+                            PRIMARY KEY (file_hash, page_idx),
+                            FOREIGN KEY (file_hash) REFERENCES report_files(file_hash)
+                        )""")
+        self.conn.commit()
+        cur.close()
+
+    def get_pages(self, file_hash: str) -> Optional[List[str]]:
+        """
+        Returns the text of each page of the report with the given hash, or None if the report is not in the store
+        """
+        cur = self.conn.cursor()
+        cur.execute("SELECT num_pages FROM report_files WHERE file_hash = ?", (file_hash,))
+        row = cur.fetchone()
+        if row is None:
+            cur.close()
+            return None
+        cur.execute("SELECT page_text FROM report_pages WHERE file_hash = ? ORDER BY page_idx", (file_hash,))
+        pages = [page_row[0] for page_row in cur.fetchall()]
+        cur.close()
+        if len(pages) != row[0]:
+            self.log.warning(f"Incomplete page text found for report {file_hash}, the report will be re-parsed")
+            return None
+        return pages
+
+    def put_pages(self, file_hash: str, pages: List[str]):
+        """Stores (or replaces) the text of each page of the report with the given hash"""
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        cur = self.conn.cursor()
+        cur.execute("DELETE FROM report_pages WHERE file_hash = ?", (file_hash,))
+        cur.execute("INSERT OR REPLACE INTO report_files(file_hash, num_pages, timestamp) VALUES(?, ?, ?)",
+                    (file_hash, len(pages), timestamp))
+        cur.executemany("INSERT INTO report_pages(file_hash, page_idx, page_text) VALUES(?, ?, ?)",
+                        [(file_hash, idx, page_text) for idx, page_text in enumerate(pages)])
+        self.conn.commit()
+        cur.close()
+
+    def close(self):
+        self.conn.close()
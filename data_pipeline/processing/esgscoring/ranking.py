@@ -0,0 +1,85 @@
+"""
+Vectorised percentile ranking of ESG scores.
+The percentiles are the same as scipy.stats.percentileofscore(column, value, kind='mean') for every value in a column,
+but are computed for all the values in a (companies x features) matrix from one sort of each column, so ranking n
+companies is O(n log n) rather than O(n^2)
+"""
+import numpy as np
+
+# Order of the columns in the matrices passed to esg_percentile_scores
+PILLARS = ["Environmental", "Social", "Governance"]
+TOPICS = ["Climate Change", "Natural Capital", "Pollution & Waste",
+          "Human Capital", "Product Liability", "Community Relations",
+          "Corporate Governance", "Business Ethics & Values"]
+
+
+def percentile_ranks(scores) -> np.ndarray:
+    """
+    Computes the 'mean' kind percentile of every value within its column.
+    Params:
+        scores: a 1D array of scores or a 2D (companies x features) matrix of scores
+    Returns:
+        Array of the same shape as scores holding the percentile (0 - 100) of each score.
+        As with scipy, a column that contains a NaN gives NaN percentiles
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    is_vector = scores.ndim == 1
+    if is_vector:
+        scores = scores[:, None]
+
+    n = scores.shape[0]
+    ranks = np.full(scores.shape, np.nan, dtype=np.float64)
+    if n == 0:
+        return ranks[:, 0] if is_vector else ranks
+
+    sorted_scores = np.sort(scores, axis=0)
+    for col in range(scores.shape[1]):
+        if np.isnan(sorted_scores[-1, col]):
+            continue
+        # left counts the scores strictly less than each score, right counts those less than or equal
+        left = np.searchsorted(sorted_scores[:, col], scores[:, col], side='left')
+        right = np.searchsorted(sorted_scores[:, col], scores[:, col], side='right')
+        ranks[:, col] = (left + right) * (50.0 / n)
+
+    return ranks[:, 0] if is_vector else ranks
+
+
+def esg_percentile_scores(We, Ws, Wg, pillar_means, topic_means) -> dict:
+    """
+    Computes the ESG percentile scores for a set of companies.
+    Params:
+        We, Ws, Wg: the weightings of the Environmental, Social and Governance scores in the overall ESG score
+        pillar_means: (companies x 3) matrix of the mean probability of each pillar (ordered as PILLARS)
+        topic_means: (companies x 8) matrix of the mean probability of each ESG topic (ordered as TOPICS)
+    Returns:
+        Dictionary of arrays with one value per company for each of the scores:
+        E1, E2, E3, S1, S2, S3, G1, G2, E, S, G, ESG, ESGscore1 and ESGscore2
+    """
+    pillar_means = np.asarray(pillar_means, dtype=np.float64).reshape(-1, len(PILLARS))
+    topic_means = np.asarray(topic_means, dtype=np.float64).reshape(-1, len(TOPICS))
+
+    # Score-1 ranks the pillar probabilities directly
+    # Score-2 ranks the pillars by the average of the pillar's topic probabilities
+    pillar_topic_means = np.column_stack([
+        1/3*(topic_means[:, 0]+topic_means[:, 1]+topic_means[:, 2]),
+        1/3*(topic_means[:, 3]+topic_means[:, 4]+topic_means[:, 5]),
+        1/2*(topic_means[:, 6]+topic_means[:, 7]),
+    ])
+    ranks = percentile_ranks(np.hstack([pillar_means, pillar_topic_means, topic_means]))
+    pillar_ranks = ranks[:, 0:3]
+    pillar_topic_ranks = ranks[:, 3:6]
+    topic_ranks = ranks[:, 6:]
+
+    ESGscore1 = We*pillar_ranks[:, 0]+Ws*pillar_ranks[:, 1]+Wg*pillar_ranks[:, 2]
+    ESGscore2 = We*pillar_topic_ranks[:, 0]+Ws*pillar_topic_ranks[:, 1]+Wg*pillar_topic_ranks[:, 2]
+
+    # for dashboard output
+    pillar_scores = np.maximum(pillar_topic_ranks, pillar_ranks)
+    scores = {name: topic_ranks[:, idx] for idx, name in enumerate(["E1", "E2", "E3", "S1", "S2", "S3", "G1", "G2"])}
+    scores["E"] = pillar_scores[:, 0]
+    scores["S"] = pillar_scores[:, 1]
+    scores["G"] = pillar_scores[:, 2]
+    scores["ESG"] = np.maximum(ESGscore1, ESGscore2)
+    scores["ESGscore1"] = ESGscore1
+    scores["ESGscore2"] = ESGscore2
+    return scores
@@ -1,42 +1,99 @@
+import io
+import mmap
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator
+
 from PyPDF2 import PdfReader
 
 
-def correct_eof_error_in_pdf(file_path:str) -> None:
+# Counts of the PDFs opened with open_pdf_reader ("checked") and of those that needed their EOF repairing ("repaired")
+eof_repair_counter = Counter()
+# Whitespace after the last %%EOF marker does not stop the PDF from being read
+_TRAILING_WHITESPACE = re.compile(rb'\s*')
+
+
+def find_pdf_end(buffer) -> int:
     """
-    Corrects the EOF error in downloaded PDFs
-    Params:
-    @file_path: Path to the pdf to be processed
+    Returns the length of the PDF content in the buffer, i.e. the end of the line containing the last %%EOF marker.
+    Anything after this is trailing data that stops the PDF from being read.
+    If there is no %%EOF marker, or only whitespace follows it, the length of the buffer is returned
     """
-    with open(file_path, 'rb') as p:
-        txt = (p.readlines())
+    eof_pos = buffer.rfind(b'%%EOF')
+    if eof_pos < 0 or _TRAILING_WHITESPACE.match(buffer, eof_pos + len(b'%%EOF')).end() == len(buffer):
+        return len(buffer)
+    end_of_line = buffer.find(b'\n', eof_pos)
+    return len(buffer) if end_of_line < 0 else end_of_line + 1
 
-    # Function to dealing with EOF error in pdf's
-    def reset_eof_of_pdf_return_stream(pdf_stream_in: list):
-        # find the line position of the EOF
-        actual_line = 0
-        for i, x in enumerate(txt[::-1]):
-            if b'%%EOF' in x:
-                actual_line = len(pdf_stream_in) - i
-                # print(f'EOF found at line position {-i} = actual {actual_line}, with value {x}')
-                break
 
-        # return the list up to that point
-        return pdf_stream_in[:actual_line]
+class _MemoryViewStream(io.RawIOBase):
+    """Read only file-like stream over a memoryview so the PDF can be read without copying it"""
 
-    # get the new list terminating correctly
-    txtx = reset_eof_of_pdf_return_stream(txt)
-    # write to new pdf
-    with open(file_path, 'wb') as f:
-        f.writelines(txtx)
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
 
+    def readable(self):
+        return True
 
-def extract_content_from_pdf(file_path: str) -> list[str]:
-    reader = PdfReader(file_path)
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = len(self._view) + offset
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def readinto(self, b):
+        num_bytes = max(0, min(len(b), len(self._view) - self._pos))
+        b[:num_bytes] = self._view[self._pos:self._pos + num_bytes]
+        self._pos += num_bytes
+        return num_bytes
 
+
+@contextmanager
+def open_pdf_reader(file_path: str) -> Iterator[PdfReader]:
+    """
+    Opens a PDF for reading, ignoring any trailing data after the last %%EOF marker that causes EOF errors.
+    The file is memory mapped and never modified; the reader is only valid inside the with block.
+    Params:
+    @file_path: Path to the pdf to be read
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be memory mapped, let PyPDF2 raise its usual error
+            yield PdfReader(f)
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            pdf_end = find_pdf_end(buffer)
+            eof_repair_counter["checked"] += 1
+            if pdf_end < len(buffer):
+                eof_repair_counter["repaired"] += 1
+            view = memoryview(buffer)[:pdf_end]
+            stream = io.BufferedReader(_MemoryViewStream(view))
+            try:
+                yield PdfReader(stream)
+            finally:
+                stream.close()
+                view.release()
+
+
+def extract_content_from_pdf(file_path: str) -> list[str]:
     content = []
-    for i in range(len(reader.pages)):
-        page_content = reader.pages[i].extract_text().strip()
-        if len(page_content) > 0:
-            content.append(page_content)
+    with open_pdf_reader(file_path) as reader:
+        for i in range(len(reader.pages)):
+            page_content = reader.pages[i].extract_text().strip()
+            if len(page_content) > 0:
+                content.append(page_content)
     return content
 
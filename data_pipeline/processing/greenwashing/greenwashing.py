@@ -1,12 +1,9 @@
 """
 Collection of functions related to producing Greenwashing insights
 """
-import torch
+from corenlp.batching import run_batched_inference
 
 def run_inference_on_text(tokenizer, model, input_texts:list[str]):
-    tokenized_data = tokenizer(input_texts, truncation=True, padding=True, return_tensors='pt')
-    with torch.no_grad():
-        outputs = model(**tokenized_data)
-    logits = outputs.logits
-    probabilities = torch.softmax(logits, dim=1)
+    # Texts are batched by token length so that short texts are not padded to the length of the longest text
+    probabilities = run_batched_inference(input_texts, tokenizer, model, max_length=None)
     return probabilities[:, 1].tolist()
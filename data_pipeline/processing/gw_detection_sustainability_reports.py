@@ -15,9 +15,9 @@ from datetime import datetime
 from pathlib import Path
 from file_processing import sustainability_reports
 import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from greenwashing import greenwashing
 from corenlp.classification import EsgTextClassification
+from corenlp.registry import acquire_sequence_classifier
 
 logger = logging.getLogger("gw_detection")
 
@@ -114,6 +114,11 @@ if __name__ == '__main__':
                         default=default_gw_model_name,
                         help=f"The name of the HuggingFace model to load for Greenwashing detection. Default is '{default_gw_model_name}'")
 
+    parser.add_argument("--inference_service", type=str,
+                        default=None,
+                        help="The url of the local inference service (e.g. http://127.0.0.1:8765) used to run the ESG "
+                             "topic classifier. Default is to load the model in this process")
+
     args = parser.parse_args()
 
     if args.data_folder is None or not os.path.exists(args.data_folder):
@@ -125,11 +130,10 @@ if __name__ == '__main__':
             f"The Insights database was not found or is not accessible. Path provided was '{args.insight_db}'")
 
     logger.info(f"Loading Greenwashing Detection Model from HuggingFace ({args.gw_model_name})")
-    gw_tokenizer = AutoTokenizer.from_pretrained(args.gw_model_name)
-    gw_model = AutoModelForSequenceClassification.from_pretrained(args.gw_model_name)
+    gw_tokenizer, gw_model = acquire_sequence_classifier(args.gw_model_name)
 
     logger.info("Loading ESG Topic Classification Model from HuggingFace")
-    esg_classifier = EsgTextClassification()
+    esg_classifier = EsgTextClassification(service_url=args.inference_service)
 
     insights_db_conn = sqlite3.connect(args.insight_db)
 
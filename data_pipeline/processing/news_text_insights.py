@@ -7,24 +7,55 @@ import glob
 import sqlite3
 from pathlib import Path
 from datetime import datetime
+from typing import List
 
 import numpy as np
 import pandas as pd
 import logging
 import argparse
 
+from corenlp.analysis import EsgTextAnalysis
 from corenlp.classification import EsgTextClassification
+from corenlp.document_analysis import DocumentAnalysis
+from corenlp.entity_linking import OrganisationLinker
 from corenlp.esg_sentiment_analysis import EsgSentimentAnalysis
 from corenlp.keywords import EsgKeywordExtractor
-from corenlp.named_entity_extraction import EntityExtractor
+from corenlp.named_entity_extraction import DEFAULT_NER_MODEL, FAST_NER_MODELS, EntityExtractor
+from corenlp.result_cache import ResultCache
 
 logger = logging.getLogger("news_text_insights")
-logger.info("Preparing models")
-esg_sent_classifier = EsgSentimentAnalysis(lazy_load=False)
-esg_classifier = EsgTextClassification(lazy_load=False)
-esg_keywords_extractor = EsgKeywordExtractor()
-entity_extractor = EntityExtractor()
-logger.info("Models loaded")
+esg_sent_classifier = None
+esg_classifier = None
+esg_analyzer = None
+esg_keywords_extractor = None
+entity_extractor = None
+document_analysis = None
+organisation_linker = None
+
+
+def load_models(service_url: str = None, keyword_cache: str = None, keyword_embeddings: str = None,
+                ner_model: str = DEFAULT_NER_MODEL):
+    """
+    Loads the models used to process the articles.
+    If service_url is given, the classifier and sentiment models are run by the local inference service
+    (see corenlp/inference_service.py) rather than loaded by this process.
+    keyword_cache is the path to the file used to keep the ESG classification of the keywords seen and
+    keyword_embeddings the path to the file used to keep their embeddings.
+    ner_model is the spaCy pipeline used to parse the articles for the entities and keywords
+    """
+    global esg_sent_classifier, esg_classifier, esg_analyzer, esg_keywords_extractor, entity_extractor, \
+        document_analysis
+    logger.info("Preparing models")
+    esg_sent_classifier = EsgSentimentAnalysis(lazy_load=False, service_url=service_url)
+    esg_classifier = EsgTextClassification(lazy_load=False, service_url=service_url)
+    # Runs the classifiers and sentiment model together so that models sharing a vocabulary share the tokenization
+    esg_analyzer = EsgTextAnalysis(esg_classifier, esg_sent_classifier)
+    esg_keywords_extractor = EsgKeywordExtractor(keyword_cache=keyword_cache,
+                                                 keyword_embeddings=keyword_embeddings)
+    entity_extractor = EntityExtractor(ner_model)
+    # Parses each article once for both the entities and the keywords
+    document_analysis = DocumentAnalysis(entity_extractor, esg_keywords_extractor)
+    logger.info("Models loaded")
 
 
 def get_org_id_by_name(conn, company_name):
@@ -75,6 +106,30 @@ def insert_doc_entities_info(conn, doc_id, entity_label, entity_type):
     return cur.lastrowid
 
 
+def create_document_organisations_table(conn):
+    """Creates the table of the organisations mentioned in each document if the insights database does not have it"""
+    sql = """ CREATE TABLE IF NOT EXISTS document_organisations (
+                    id integer PRIMARY KEY,
+                    document_id integer NOT NULL,
+                    org_id integer NOT NULL,
+                    mention text NOT NULL,
+                    FOREIGN KEY (document_id) REFERENCES documents(id),
+                    FOREIGN KEY (org_id) REFERENCES organisations(id)
+                )"""
+    cur = conn.cursor()
+    cur.execute(sql)
+    conn.commit()
+
+
+def insert_doc_organisation_info(conn, doc_id, org_id, mention):
+    sql = """ INSERT INTO document_organisations(document_id, org_id, mention)
+                        VALUES(?, ?, ?)"""
+    cur = conn.cursor()
+    cur.execute(sql, [doc_id, org_id, mention])
+    conn.commit()
+    return cur.lastrowid
+
+
 def insert_doc_keywords_info(conn, doc_id, keyword):
     sql = """ INSERT INTO document_keywords(document_id, keyword)
                             VALUES(?, ?)"""
@@ -84,52 +139,17 @@ def insert_doc_keywords_info(conn, doc_id, keyword):
     return cur.lastrowid
 
 
-def rescale_sentiments(sentiments):
+def process_content(company_name: str, content: str):
     """
-    Rescales the probability values for the 3 sentiments so that we have a single value in the range -1 to 1 where
-        - values close to +1 indicate a high probability of a Positive sentiment
-        - values close to -1 indicate a high probability of a Negative sentiment
-        - values close to 0 indicate a high probability of a Neutral sentiment
+    Extracts the sentiment and parts of an article.
+    The entities and keywords are extracted separately for all the articles of a file (see analyze_documents)
     """
-    rescaled_sents = []
-
-    def rescale_sentiment(sentiment):
-        sentiment.sort(key=lambda a: a[1], reverse=True)
-        sent_label = sentiment[0][0].lower()
-        sent_prob = sentiment[0][1] * (2.0 / 3.0)  # Normalise into a range between 0 to 2/3
-
-        if sent_label == "positive":
-            # Most likely Positive
-            # Shift to range +1/3 to 1 with 1 being definitely positive
-            return (1.0 / 3.0) + sent_prob
-        elif sent_label == "negative":
-            # Most likely Negative
-            # Shift to range -1/3 to -1 with -1 being definitely negative
-            return (-1.0 / 3.0) - sent_prob
-        else:
-            # Most likely Neutral
-            # This is more complex since we want the definitely neutral to be 0
-            # But less neutral to move closer to either -1 or +1 depending upon the next most likely score
-            # So we shift the range to -1/3 to 0 and then check the second most likely answer and
-            # if it is positive multiply by -1 to give a value in the range 0 to 1/3 or leave as range -1/3 to 0
-            # Shift to range -1/3 to +1/3 with 0 being definitely neutral
-            sent_prob = (sent_prob / 2.0) - (1.0 / 3.0)
-            if sentiment[1][0].lower() == "positive":
-                sent_prob = sent_prob * (-1.0)
-            return sent_prob
-
-    for s in sentiments:
-        rescaled_sents.append(rescale_sentiment(s))
-
-    return rescaled_sents
-
-
-def process_content(company_name: str, content: str):
     # Store document level information
     # Chunk content into paragraphs and run sentiment on ESG Parts and store parts
     parts = [part.strip() for part in content.split('\n') if len(part.strip()) > 0]
-    esg_topics = esg_classifier.get_esg_topic(parts)
-    esg_sents = rescale_sentiments(esg_sent_classifier.get_esg_sentiment(parts))
+    analysis = esg_analyzer.analyze(parts, tasks=("topic", "sentiment"))
+    esg_topics = analysis["topic"].tolist()
+    esg_sents = analysis["sentiment"].tolist()
 
     try:
         doc_parts = [{"content": part, "topic": topic, "sentiment": sentiment} for part, topic, sentiment in
@@ -139,30 +159,38 @@ def process_content(company_name: str, content: str):
 
     doc_sent = np.mean(esg_sents)
 
-    # Extract Entities and store entities
-    entities = entity_extractor.extract_entities(content)
-
-    # Keyword Extraction and store keywords
-    ignore_terms = set()
-    ignore_terms.add(company_name)
-    for entity in entities.values():
-        ignore_terms.update(entity)
-    keywords = esg_keywords_extractor.get_esg_keywords(content, ignore_terms=list(ignore_terms), top_n=20)
-
     # ToDo: Currently unable to integrate the LLM based Controversy Detection or Relationship Extraction models
     #   These appear to require CUDA/GPU to run inference which is not available in most of the developer environments
     #   and may not be available in the deployment environment
     # Detect Controversy and store controversy (if detected)
     # Extract Relationship triplets
 
-    return {"doc_sentiment": doc_sent, "doc_parts": doc_parts, "keywords": keywords, "entities": entities}
+    return {"doc_sentiment": doc_sent, "doc_parts": doc_parts}
+
+
+def analyze_documents(company_name: str, articles: List[dict], n_process: int = 1, batch_size: int = 64):
+    """
+    Extracts the entities and ESG keywords of a list of processed articles, parsing each article once and streaming
+    the articles through spaCy together rather than one at a time. The company name and the entities of an article are
+    ignored when extracting its keywords. The ORG entities are linked to the organisations in the insights database.
+    The results are stored in the "entities", "keywords" and "organisations" (mention -> org ids) entries of each
+    article's content info
+    """
+    results = document_analysis.analyze_many((article["content"] for article in articles),
+                                             ignore_terms=([company_name] for _ in articles),
+                                             top_n=20, batch_size=batch_size, n_process=n_process)
+    for article, result in zip(articles, results):
+        article["content_info"]["entities"] = result["entities"]
+        article["content_info"]["keywords"] = result["keywords"]
+        article["content_info"]["organisations"] = organisation_linker.link_mentions(result["entities"]["ORG"])
 
 
-def process_gdelt_articles(data_folder: str, insights_db_conn: sqlite3.Connection):
+def process_gdelt_articles(data_folder: str, insights_db_conn: sqlite3.Connection, spacy_processes: int = 1):
     """
     Function to process the files generated by the GDELT Article Downloader script.
     These are CSV files that contain metadata about the articles and the article content.
     These files are .csv fies and the filename is of the form <company_name>_<download_timestamp>.csv
+    spacy_processes is the number of processes used by spaCy to parse the articles for entity and keyword extraction
     """
     logger.info("Processing data from GDELT database")
 
@@ -179,6 +207,9 @@ def process_gdelt_articles(data_folder: str, insights_db_conn: sqlite3.Connectio
         # Process each row
         num_articles = df.shape[0]
         logger.info(f"Processing articles for {company_name} - {num_articles} articles found")
+        # Pick up any organisation aliases added since the last file
+        organisation_linker.refresh(insights_db_conn)
+        articles = []
         for idx in range(num_articles):
             logger.info(f"Process article {idx + 1} of {num_articles}")
             # If the row has content then process otherwise skip
@@ -187,9 +218,9 @@ def process_gdelt_articles(data_folder: str, insights_db_conn: sqlite3.Connectio
                 logger.info("No content found for article")
                 continue
             # get the content and check if it is ESG related
-            esg_category = esg_classifier.is_esg_related(content)
+            esg_category = esg_analyzer.analyze(content, tasks=("coarse",))
             # If the top classification is None then skip
-            broad_cat = esg_category[0][0]['label'].strip()
+            broad_cat = esg_category["coarse_label"][0].strip()
             if broad_cat.lower() == "none":
                 logger.info("Content is not ESG Related")
                 continue
@@ -201,6 +232,21 @@ def process_gdelt_articles(data_folder: str, insights_db_conn: sqlite3.Connectio
 
             # Extract insights from the article content
             content_info = process_content(company_name, content)
+            articles.append({"content": content, "content_info": content_info, "broad_cat": broad_cat,
+                             "pub_date": pub_date, "source_country": source_country, "source_url": source_url,
+                             "doc_type": doc_type})
+
+        # Entities and keywords are extracted for all the ESG articles of the file together
+        logger.info(f"Extracting entities and keywords from {len(articles)} ESG articles")
+        analyze_documents(company_name, articles, n_process=spacy_processes)
+
+        for article in articles:
+            content_info = article["content_info"]
+            broad_cat = article["broad_cat"]
+            pub_date = article["pub_date"]
+            source_country = article["source_country"]
+            source_url = article["source_url"]
+            doc_type = article["doc_type"]
 
             # Store the metadata and extracted insights into the insights database
             doc_id = insert_doc_info(insights_db_conn, company_id, broad_cat, pub_date, source_url, source_country,
@@ -208,7 +254,7 @@ def process_gdelt_articles(data_folder: str, insights_db_conn: sqlite3.Connectio
 
             for part_idx, part in enumerate(content_info["doc_parts"]):
                 part_content = part["content"]
-                topic = part["topic"][0]['label']
+                topic = part["topic"]
                 sentiment = part["sentiment"]
 
                 insert_doc_parts_info(insights_db_conn, doc_id, part_idx, part_content, topic)
@@ -219,6 +265,9 @@ def process_gdelt_articles(data_folder: str, insights_db_conn: sqlite3.Connectio
                     insert_doc_entities_info(insights_db_conn, doc_id, entity_label, entity_type)
             for keyword in content_info["keywords"]:
                 insert_doc_keywords_info(insights_db_conn, doc_id, keyword)
+            for mention, org_ids in content_info["organisations"].items():
+                for org_id in org_ids:
+                    insert_doc_organisation_info(insights_db_conn, doc_id, org_id, mention)
 
     logger.info("Processing Complete")
 
@@ -236,6 +285,38 @@ if __name__ == '__main__':
     parser.add_argument("--insight_db", type=str,
                         default="./insights.db",
                         help="The path to the insights database file")
+    parser.add_argument("--result_cache", type=str,
+                        default=None,
+                        help="The path to the SQLite file used to cache the classifier and sentiment predictions, "
+                             "e.g. classifier_cache.db. Default is not to cache the predictions")
+    parser.add_argument("--result_cache_size", type=int,
+                        default=2000000,
+                        help="The maximum number of predictions kept in the result cache. Default 2000000")
+    parser.add_argument("--inference_service", type=str,
+                        default=None,
+                        help="The url of the local inference service (e.g. http://127.0.0.1:8765) used to run the "
+                             "classifier and sentiment models. Default is to load the models in this process")
+    parser.add_argument("--keyword_cache", type=str,
+                        default=None,
+                        help="The path to the SQLite file used to keep the ESG classification of each keyword seen. "
+                             "Default is keyword_labels.db in the same folder as the insights database")
+    parser.add_argument("--warm_keyword_cache", action="store_true",
+                        help="Classify the keywords stored for earlier articles that are not in the keyword cache "
+                             "before processing the articles, e.g. after starting a new keyword cache")
+    parser.add_argument("--keyword_embeddings", type=str,
+                        default=None,
+                        help="The path to the file used to keep the embedding of each keyword seen, used to cluster "
+                             "the keywords. Default is keyword_embeddings.f32 in the same folder as the insights "
+                             "database")
+    parser.add_argument("--ner_model", type=str,
+                        default=DEFAULT_NER_MODEL, choices=(DEFAULT_NER_MODEL,) + FAST_NER_MODELS,
+                        help=f"The spaCy pipeline used to parse the articles for entity and keyword extraction. "
+                             f"Default {DEFAULT_NER_MODEL}, the smaller {' and '.join(FAST_NER_MODELS)} pipelines "
+                             f"are much faster")
+    parser.add_argument("--spacy_processes", type=int,
+                        default=1,
+                        help="The number of processes used by spaCy to parse the articles for entity and keyword "
+                             "extraction. Default 1")
 
     args = parser.parse_args()
 
@@ -248,8 +329,33 @@ if __name__ == '__main__':
             f"The Insights database was not found or is not accessible. Path provided was '{args.insight_db}'")
 
     insights_db_conn = sqlite3.connect(args.insight_db)
+    create_document_organisations_table(insights_db_conn)
+    # The ORG entities of the articles are linked to the organisations using the aliases in the insights database
+    organisation_linker = OrganisationLinker(insights_db_conn)
+    keyword_cache_path = args.keyword_cache
+    if keyword_cache_path is None:
+        keyword_cache_path = os.path.join(os.path.dirname(os.path.abspath(args.insight_db)), "keyword_labels.db")
+    keyword_embeddings_path = args.keyword_embeddings
+    if keyword_embeddings_path is None:
+        keyword_embeddings_path = os.path.join(os.path.dirname(os.path.abspath(args.insight_db)),
+                                               "keyword_embeddings.f32")
+    load_models(args.inference_service, keyword_cache_path, keyword_embeddings_path, args.ner_model)
+    if args.warm_keyword_cache:
+        # Keywords already stored for earlier articles are classified up front so they skip the model when seen again
+        num_warmed = esg_keywords_extractor.warm_keyword_cache(insights_db_conn)
+        logger.info(f"Classified {num_warmed} stored keywords that were not in the keyword cache")
+
+    # Repeated texts (syndicated articles, boilerplate paragraphs) are served from the cache rather than the models
+    result_cache = None
+    if args.result_cache is not None:
+        result_cache = ResultCache(args.result_cache, max_disk_entries=args.result_cache_size)
+        esg_classifier.cache = result_cache
+        esg_sent_classifier.cache = result_cache
 
     # At the moment, we only support gdelt as a news source but we could add additional sources
     if args.source.lower().strip() == "gdelt":
-        process_gdelt_articles(args.data_folder, insights_db_conn)
+        process_gdelt_articles(args.data_folder, insights_db_conn, args.spacy_processes)
+    if result_cache is not None:
+        logger.info(f"Result cache statistics: {result_cache.stats()}")
+        result_cache.close()
     logger.info("Processing Complete")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts and tests import corenlp and esgscoring as top level packages from the processing folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
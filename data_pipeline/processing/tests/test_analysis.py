@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from corenlp.analysis import rescale_sentiment_probabilities
+
+
+def test_rescale_sentiment_probabilities():
+    # Probabilities of (Positive, Neutral, Negative)
+    probs = np.array([[0.9, 0.05, 0.05],  # Positive: 1/3 to 1
+                      [0.2, 0.5, 0.3],  # Neutral then Negative: -1/3 to 0
+                      [0.3, 0.5, 0.2],  # Neutral then Positive: 0 to 1/3
+                      [0.1, 0.1, 0.8],  # Negative: -1/3 to -1
+                      [0.0, 1.0, 0.0],  # Definitely neutral
+                      [1 / 3, 1 / 3, 1 / 3]])  # Ties are resolved in label order
+
+    np.testing.assert_allclose(rescale_sentiment_probabilities(probs),
+                               [1 / 3 + 0.6, -1 / 6, 1 / 6, -1 / 3 - 1.6 / 3, 0.0, 1 / 3 + 2 / 9], atol=1e-12)
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from corenlp.batching import length_bucketed_batches, run_batched_inference, run_shared_batched_inference
+
+WORDS = ["carbon", "emissions", "water", "board", "diversity", "pollution", "waste", "the", "company", "reduced"]
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tmp_path_factory):
+    vocab_file = os.path.join(tmp_path_factory.mktemp("vocab"), "vocab.txt")
+    with open(vocab_file, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+    return transformers.BertTokenizerFast(vocab_file=vocab_file)
+
+
+def _make_model(tokenizer, num_labels: int, seed: int):
+    torch.manual_seed(seed)
+    config = transformers.BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=2,
+                                     num_attention_heads=2, intermediate_size=64, num_labels=num_labels)
+    return transformers.BertForSequenceClassification(config).eval()
+
+
+def _padded_inference(texts, tokenizer, model, max_length):
+    """The predictions of the model with every text padded to the longest text, as before batching"""
+    tok_inputs = tokenizer(texts, padding=True, truncation=True, max_length=max_length, return_tensors="pt")
+    with torch.inference_mode():
+        return torch.nn.functional.softmax(model(**tok_inputs).logits, dim=-1)
+
+
+def _texts(num_texts: int):
+    # Texts of very different lengths, so they fall into different batches
+    return [" ".join(WORDS[(idx + word) % len(WORDS)] for word in range(1 + (idx * 7) % 40))
+            for idx in range(num_texts)]
+
+
+def test_matches_padded_inference(tokenizer):
+    model = _make_model(tokenizer, 4, seed=0)
+    texts = _texts(30)
+
+    predictions = run_batched_inference(texts, tokenizer, model, max_length=32, max_tokens=128, max_batch_size=4)
+
+    assert predictions.shape == (30, 4)
+    torch.testing.assert_close(predictions, _padded_inference(texts, tokenizer, model, 32), atol=1e-5, rtol=1e-4)
+
+
+def test_shared_inference_matches_each_model(tokenizer):
+    models = [_make_model(tokenizer, 3, seed=1), _make_model(tokenizer, 9, seed=2)]
+    texts = _texts(12)
+
+    predictions = run_shared_batched_inference(texts, tokenizer, models, max_tokens=64)
+
+    for model, model_predictions in zip(models, predictions):
+        torch.testing.assert_close(model_predictions, _padded_inference(texts, tokenizer, model, 512),
+                                   atol=1e-5, rtol=1e-4)
+
+
+def test_single_text_and_empty_list(tokenizer):
+    model = _make_model(tokenizer, 3, seed=3)
+
+    assert run_batched_inference("carbon emissions", tokenizer, model).shape == (1, 3)
+    assert run_batched_inference([], tokenizer, model).shape == (0, 3)
+
+
+def test_batches_stay_within_token_budget():
+    lengths = [5, 50, 7, 300, 6, 48, 51]
+
+    batches = length_bucketed_batches(lengths, max_tokens=110, max_batch_size=3)
+
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or len(batch) * max(lengths[idx] for idx in batch) <= 110
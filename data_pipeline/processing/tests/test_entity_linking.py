@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("cleanco")
+
+from corenlp.entity_linking import OrganisationLinker
+
+BP_ID = 1
+BP_ENERGY_ID = 2
+
+
+@pytest.fixture
+def linker():
+    linker = OrganisationLinker()
+    linker.add_aliases([(1, BP_ID, "BP"), (2, BP_ENERGY_ID, "BP Energy Partners")])
+    return linker
+
+
+def test_short_alias_links_exact_mention(linker):
+    assert linker.link_mention("BP") == (BP_ID,)
+    assert linker.link_mention("bp plc") == (BP_ID,)
+
+
+def test_short_alias_does_not_link_containing_mention(linker):
+    assert linker.link_mention("the BP-style group") == ()
+    assert linker.link_mention("BP Exploration Alaska") == ()
+    assert linker.link_mentions(["HP", "BPX Energy"]) == {}
+
+
+def test_long_alias_links_containing_mention(linker):
+    assert linker.link_mention("the BP Energy Partners fund") == (BP_ENERGY_ID,)
@@ -0,0 +1,58 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from esgscoring.feature_store import (create_report_features_table, get_latest_report_features, has_report_features,
+                                      store_report_features)
+from esgscoring.features import FEATURE_COLUMNS
+
+
+def _features(value: float) -> np.ndarray:
+    return np.full(len(FEATURE_COLUMNS), value, dtype=np.float32)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    create_report_features_table(conn)
+    yield conn
+    conn.close()
+
+
+def test_latest_report_is_picked_by_report_date(conn):
+    # The newer report is stored first, as os.listdir can list it first
+    store_report_features(conn, 1, "hash-2023", "Acme 2023", _features(2023), "v1", "20230601000000")
+    store_report_features(conn, 1, "hash-2022", "Acme 2022", _features(2022), "v1", "20220601000000")
+
+    org_ids, features = get_latest_report_features(conn, "v1")
+
+    assert org_ids == [1]
+    np.testing.assert_array_equal(features[0], _features(2023))
+
+
+def test_only_features_of_the_version_are_ranked(conn, caplog):
+    store_report_features(conn, 1, "hash-1", "Acme", _features(1), "v1", "20230601000000")
+    store_report_features(conn, 2, "hash-2", "Globex", _features(2), "v2", "20230601000000")
+    store_report_features(conn, 3, "hash-3", "Initech", _features(3), "v1", "20230601000000")
+    store_report_features(conn, 3, "hash-3b", "Initech", _features(4), "v2", "20240601000000")
+
+    org_ids, features = get_latest_report_features(conn, "v2")
+
+    assert org_ids == [2, 3]
+    np.testing.assert_array_equal(features, np.stack([_features(2), _features(4)]))
+    assert "[1]" in caplog.text
+    assert has_report_features(conn, 1, "hash-1", "v1")
+    assert not has_report_features(conn, 1, "hash-1", "v2")
+
+
+def test_tables_of_earlier_versions_are_migrated():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""CREATE TABLE organisations_esg_report_features (
+                        id integer PRIMARY KEY, org_id integer NOT NULL, report_hash text NOT NULL, report_name text,
+                        timestamp text NOT NULL, num_features integer NOT NULL, features blob NOT NULL,
+                        UNIQUE (org_id, report_hash))""")
+    create_report_features_table(conn)
+    store_report_features(conn, 1, "hash-1", "Acme", _features(1), "v1", "20230601000000")
+
+    assert get_latest_report_features(conn, "v1")[0] == [1]
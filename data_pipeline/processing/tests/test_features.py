@@ -0,0 +1,52 @@
+import numpy as np
+
+from esgscoring.features import (BROAD_CATEGORIES, ESG_TOPICS, FEATURE_COLUMNS, aggregate_labels,
+                                 report_feature_matrix)
+
+
+def _aggregate_per_label(report_idx, labels, probs, n_reports, label_names):
+    """The aggregation done by filtering the pages of each report once per label"""
+    out = np.zeros((n_reports, 2 * len(label_names)))
+    for report in range(n_reports):
+        for col, label in enumerate(label_names):
+            label_probs = [prob for idx, page_label, prob in zip(report_idx, labels, probs)
+                           if idx == report and page_label == label]
+            if len(label_probs) > 0:
+                out[report, col] = np.mean(label_probs)
+                out[report, len(label_names) + col] = np.max(label_probs)
+    return out
+
+
+def test_matches_per_label_aggregation():
+    rng = np.random.default_rng(0)
+    n_reports = 6
+    report_idx = rng.integers(0, n_reports - 1, 300)  # the last report has no pages
+    labels = rng.choice(ESG_TOPICS + ["Unknown"], 300).tolist()
+    probs = rng.random(300)
+
+    features = aggregate_labels(report_idx, labels, probs, n_reports, ESG_TOPICS)
+
+    assert features.shape == (n_reports, 2 * len(ESG_TOPICS))
+    np.testing.assert_allclose(features, _aggregate_per_label(report_idx, labels, probs, n_reports, ESG_TOPICS),
+                               rtol=1e-6)
+    assert not features[-1].any()
+
+
+def test_report_feature_matrix_columns():
+    broad_category = [[{"label": "Environmental", "prob": 0.9}, {"label": "None", "prob": 0.1}],
+                      [{"label": "Environmental", "prob": 0.5}, {"label": "None", "prob": 0.4}],
+                      [{"label": "Social", "prob": 0.7}, {"label": "None", "prob": 0.3}]]
+    esg_topic = [[{"label": "Climate Change", "prob": 0.8}],
+                 [{"label": "Pollution & Waste", "prob": 0.6}],
+                 [{"label": "Human Capital", "prob": 0.4}]]
+
+    features = report_feature_matrix([0, 0, 1], broad_category, esg_topic, 2)
+
+    assert features.shape == (2, len(FEATURE_COLUMNS)) and features.dtype == np.float32
+    row = dict(zip(FEATURE_COLUMNS, features[0]))
+    assert row["Environmental_mean"] == np.float32(0.7)
+    assert row["Environmental_max"] == np.float32(0.9)
+    assert row["Climate Change_mean"] == np.float32(0.8)
+    assert row["Social_mean"] == 0.0
+    assert dict(zip(FEATURE_COLUMNS, features[1]))["Human Capital_max"] == np.float32(0.4)
+    assert len(FEATURE_COLUMNS) == 2 * (len(BROAD_CATEGORIES) + len(ESG_TOPICS))
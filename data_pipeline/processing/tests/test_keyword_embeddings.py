@@ -0,0 +1,62 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from corenlp.keyword_embeddings import KeywordEmbeddingStore
+
+DIM = 4
+
+
+def _embedding(keyword: str) -> np.ndarray:
+    """An embedding that can be recomputed from the keyword, to check each keyword points at its own row"""
+    return np.full(DIM, sum(map(ord, keyword)), dtype=np.float32)
+
+
+def _add_keywords(path: str, prefix: str):
+    store = KeywordEmbeddingStore(path, "model", DIM)
+    for i in range(50):
+        keywords = [f"{prefix} {i}", f"shared {i}"]
+        store.add_many(keywords, np.stack([_embedding(keyword) for keyword in keywords]))
+
+
+def _check_store(path: str, expected_keywords):
+    store = KeywordEmbeddingStore(path, "model", DIM)
+    assert set(store.index) == set(expected_keywords)
+    for keyword in expected_keywords:
+        np.testing.assert_array_equal(store.get(keyword), _embedding(keyword))
+
+
+def test_stores_sharing_a_file_keep_rows_aligned(tmp_path):
+    path = os.path.join(tmp_path, "embeddings.f32")
+    first = KeywordEmbeddingStore(path, "model", DIM)
+    second = KeywordEmbeddingStore(path, "model", DIM)
+    first.add_many(["carbon", "water"], np.stack([_embedding("carbon"), _embedding("water")]))
+    second.add_many(["water", "board"], np.stack([_embedding("water"), _embedding("board")]))
+
+    assert len(second) == 3
+    np.testing.assert_array_equal(second.get("carbon"), _embedding("carbon"))
+    _check_store(path, ["carbon", "water", "board"])
+
+
+def test_concurrent_processes_keep_rows_aligned(tmp_path):
+    path = os.path.join(tmp_path, "embeddings.f32")
+    processes = [multiprocessing.Process(target=_add_keywords, args=(path, prefix)) for prefix in ("news", "report")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    _check_store(path, [f"{prefix} {i}" for prefix in ("news", "report", "shared") for i in range(50)])
+
+
+def test_get_many_of_consecutive_rows_is_a_view(tmp_path):
+    store = KeywordEmbeddingStore(os.path.join(tmp_path, "embeddings.f32"), "model", DIM)
+    keywords = ["carbon", "water", "board"]
+    store.add_many(keywords, np.stack([_embedding(keyword) for keyword in keywords]))
+
+    assert np.shares_memory(store.get_many(["water", "board"]), store._vectors)
+    reordered = store.get_many(["board", "carbon"])
+    assert not np.shares_memory(reordered, store._vectors)
+    np.testing.assert_array_equal(reordered, np.stack([_embedding("board"), _embedding("carbon")]))
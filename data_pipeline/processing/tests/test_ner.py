@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+spacy = pytest.importorskip("spacy")
+if not spacy.util.is_package("en_core_web_sm"):
+    pytest.skip("en_core_web_sm is not installed", allow_module_level=True)
+
+from corenlp.ner import (EXAMPLE_TRAIN_DATA, LATEST_VERSION_FILE, TRAINING_INFO_FILE, CustomNerTagger,
+                         latest_ner_model_version, train_ner_model)
+
+
+def test_train_into_new_directory(tmp_path):
+    output_dir = os.path.join(tmp_path, "models", "ner_model")
+    model_path = train_ner_model(EXAMPLE_TRAIN_DATA, output_dir, epochs=1)
+
+    assert os.path.isdir(model_path)
+    assert os.path.exists(os.path.join(model_path, TRAINING_INFO_FILE))
+    assert os.path.exists(os.path.join(output_dir, LATEST_VERSION_FILE))
+    assert latest_ner_model_version(output_dir) == os.path.basename(model_path)
+    assert isinstance(CustomNerTagger(output_dir).tag("Apple is a technology company."), dict)
+
+
+def test_runs_on_the_same_data_get_their_own_version(tmp_path):
+    first_path = train_ner_model(EXAMPLE_TRAIN_DATA, str(tmp_path), epochs=1)
+    second_path = train_ner_model(EXAMPLE_TRAIN_DATA, str(tmp_path), epochs=1)
+
+    assert first_path != second_path
+    assert latest_ner_model_version(str(tmp_path)) == os.path.basename(second_path)
+    assert sorted(os.listdir(tmp_path)) == sorted([LATEST_VERSION_FILE, os.path.basename(first_path),
+                                                   os.path.basename(second_path)])
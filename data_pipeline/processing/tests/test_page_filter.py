@@ -0,0 +1,46 @@
+import random
+import re
+
+from esgscoring.page_filter import EsgPageFilter
+
+
+def _select_esg_pages(report):
+    """The page selection of the scorer before the keyword filter, one search per focus term"""
+    return [idx for idx, text in enumerate(report)
+            if re.search("Environmental", text) or re.search("Social", text) or re.search("Governance", text)]
+
+
+def test_default_keywords_match_previous_selection():
+    rng = random.Random(0)
+    words = ["Environmental", "environmental", "Social", "Socially", "Governance", "report", "revenue", "the"]
+    report = [" ".join(rng.choice(words) for _ in range(rng.randint(0, 6))) for _ in range(200)]
+
+    assert EsgPageFilter.from_file().select_pages(report) == _select_esg_pages(report)
+
+
+def test_max_pages_keeps_densest_pages_in_page_order():
+    page_filter = EsgPageFilter({"E": ["carbon"], "S": ["diversity"]}, max_pages=2)
+    report = ["carbon " + "x" * 100,  # 1 hit in a long page
+              "no keywords",
+              "carbon diversity",  # 2 hits in a short page
+              "carbon"]
+
+    assert page_filter.select_pages(report) == [2, 3]
+
+
+def test_count_hits_per_pillar():
+    page_filter = EsgPageFilter({"E": ["carbon", "carbon emissions"], "G": ["board"]}, ignore_case=True)
+
+    # The longer term is counted once rather than its prefix
+    assert page_filter.count_hits("Carbon emissions fell, the BOARD said carbon").tolist() == [2, 1]
+    assert EsgPageFilter({"E": ["carbon"]}).count_hits("Carbon").tolist() == [0]
+
+
+def test_signature_changes_with_settings():
+    vocabulary = {"E": ["carbon", "water"], "G": ["board"]}
+    signature = EsgPageFilter(vocabulary).signature()
+
+    assert EsgPageFilter({"G": ["board"], "E": ["water", "carbon", "water"]}).signature() == signature
+    assert EsgPageFilter(vocabulary, max_pages=10).signature() != signature
+    assert EsgPageFilter(vocabulary, ignore_case=True).signature() != signature
+    assert EsgPageFilter({"E": ["carbon"], "G": ["board"]}).signature() != signature
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from esgscoring.ranking import PILLARS, TOPICS, esg_percentile_scores, percentile_ranks
+
+stats = pytest.importorskip("scipy.stats")
+
+
+def _scipy_percentile_ranks(scores: np.ndarray) -> np.ndarray:
+    """The percentiles computed as the scorer did before, with a percentileofscore call per value"""
+    return np.array([[stats.percentileofscore(scores[:, col], value, kind='mean') for col, value in enumerate(row)]
+                     for row in scores])
+
+
+@pytest.mark.parametrize("num_companies", [1, 2, 7, 200])
+def test_matches_scipy_with_ties(num_companies):
+    rng = np.random.default_rng(num_companies)
+    # Rounding gives many tied scores in each column
+    scores = np.round(rng.random((num_companies, 5)), 1)
+    scores[:, 4] = 0.5
+
+    np.testing.assert_array_equal(percentile_ranks(scores), _scipy_percentile_ranks(scores))
+
+
+def test_vector_matches_scipy():
+    scores = np.array([0.3, 0.1, 0.3, 0.9, 0.1, 0.3])
+
+    ranks = percentile_ranks(scores)
+
+    assert ranks.shape == scores.shape
+    np.testing.assert_array_equal(ranks, _scipy_percentile_ranks(scores[:, None])[:, 0])
+
+
+def test_column_with_nan_gives_nan():
+    scores = np.array([[0.1, 0.2], [np.nan, 0.4], [0.3, 0.6]])
+
+    ranks = percentile_ranks(scores)
+
+    assert np.isnan(ranks[:, 0]).all()
+    np.testing.assert_array_equal(ranks, _scipy_percentile_ranks(scores))
+
+
+def test_single_company_scores():
+    scores = esg_percentile_scores(0.45, 0.3, 0.25, np.full((1, len(PILLARS)), 0.5), np.full((1, len(TOPICS)), 0.5))
+
+    assert scores["E1"].tolist() == [50.0]
+    assert scores["ESG"].tolist() == [pytest.approx(50.0)]
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from corenlp.results import ClassificationResult, label_vocabulary
+
+LABELS = ["Environmental", "Social", "Governance", "None"]
+
+
+@pytest.fixture
+def probs():
+    # The second text has tied labels, which keep their label order
+    return torch.tensor([[0.1, 0.6, 0.2, 0.1],
+                         [0.3, 0.3, 0.1, 0.3],
+                         [0.05, 0.05, 0.1, 0.8]])
+
+
+def _sorted_label_dicts(probs):
+    """The list of dictionaries the classifiers built before the array results, one sort per text"""
+    return [sorted([{"label": LABELS[idx], "prob": prob.item()} for idx, prob in enumerate(row)],
+                   key=lambda x: x["prob"], reverse=True) for row in probs]
+
+
+def test_label_dicts_match_per_text_sort(probs):
+    result = ClassificationResult(probs, LABELS)
+
+    assert len(result) == 3
+    assert result.to_label_dicts() == _sorted_label_dicts(probs)
+    assert result.to_label_tuples() == [[(pred["label"], pred["prob"]) for pred in preds]
+                                        for preds in _sorted_label_dicts(probs)]
+
+
+def test_top_labels(probs):
+    result = ClassificationResult(probs, label_vocabulary(dict(enumerate(LABELS))))
+
+    labels, top_probs = result.top_labels()
+    assert labels.tolist() == ["Social", "Environmental", "None"]
+    np.testing.assert_array_equal(top_probs, probs.max(dim=1).values.numpy())
+
+    labels, top_probs = result.top_k(2)
+    assert labels.tolist() == [["Social", "Governance"], ["Environmental", "Social"], ["None", "Governance"]]
+    assert top_probs.shape == (3, 2)
+
+
+def test_map_labels(probs):
+    # Environmental, Social and Governance are combined into ESG
+    mapping = np.array([[1, 0], [1, 0], [1, 0], [0, 1]])
+
+    mapped = ClassificationResult(probs, LABELS).map_labels(mapping, ["ESG", "None"])
+
+    assert mapped.labels.tolist() == ["ESG", "None"]
+    np.testing.assert_allclose(mapped.probs, [[0.9, 0.1], [0.7, 0.3], [0.2, 0.8]], rtol=1e-6)
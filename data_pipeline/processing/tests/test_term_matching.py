@@ -0,0 +1,77 @@
+import random
+import re
+
+import pytest
+
+from corenlp.term_matching import TermTrie
+
+
+def _regex_remove(text, terms):
+    """
+    The removal done with one regex per term before the trie, with the longest terms first. Each regex is applied
+    until the text no longer changes, since the regex consumes the character before and after a term
+    """
+    for term in sorted(terms, key=len, reverse=True):
+        regex = re.compile(f"(^|\\s|\\W){re.escape(term)}($|\\s|\\W)", flags=re.IGNORECASE)
+        while True:
+            replaced = regex.sub(" ", text)
+            if replaced == text:
+                break
+            text = replaced
+    return text
+
+
+def _words(text):
+    """The words left in a text. The trie keeps the characters around a term that the regex replaced"""
+    return re.findall(r"\w+", text)
+
+
+@pytest.mark.parametrize("text, terms", [
+    # Longest match
+    ("Offices in New York and new york city", ["new", "new york", "new york city"]),
+    # Word boundaries: terms inside other words are not removed
+    ("Acmeco and Acme, with Acme's (Acme) sub-Acme unit", ["Acme"]),
+    ("carbon-neutral carbon_credits carbons carbon", ["carbon"]),
+    ("Terms with punctuation: U.S. and A.B. Corp", ["U.S.", "A.B. Corp"]),
+    # Case folding
+    ("ACME acme AcMe Straße STRASSE", ["acme", "straße"]),
+    ("", ["acme"]),
+    ("nothing to remove", []),
+])
+def test_matches_regex_removal(text, terms):
+    assert _words(TermTrie(terms).replace(text)) == _words(_regex_remove(text, terms))
+
+
+def test_matches_regex_removal_on_random_texts():
+    rng = random.Random(0)
+    words = ["Acme", "ACME", "Acmeco", "Group", "group", "Holdings", "carbon", "water", "the", ",", ".", "-", "'s"]
+    terms = ["acme", "acme group", "acme group holdings", "carbon", "the"]
+    trie = TermTrie(terms)
+    for _ in range(500):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(0, 12)))
+        assert _words(trie.replace(text)) == _words(_regex_remove(text, terms)), text
+
+
+def test_find_all_returns_longest_non_overlapping_matches():
+    trie = TermTrie()
+    trie.add("new", "NEW")
+    trie.add("new york", "NY")
+    trie.add("york city", "YC")
+
+    # The leftmost match is taken first, so "york city" overlapping "new york" is not matched
+    assert trie.find_all("New York City, york city") == [(0, 8, "NY"), (15, 24, "YC")]
+
+
+def test_adjacent_terms_are_all_removed():
+    # A single regex pass missed the second term as the space between them had been consumed by the first match
+    assert _words(TermTrie(["acme"]).replace("Acme Acme Acme rose")) == ["rose"]
+
+
+def test_add_remove_and_get():
+    trie = TermTrie(["acme", "acme group"])
+    trie.remove("acme")
+
+    assert len(trie) == 1
+    assert trie.get("ACME") is None
+    assert trie.get("Acme Group") == "acme group"
+    assert trie.find_all("Acme Group and Acme") == [(0, 10, "acme group")]
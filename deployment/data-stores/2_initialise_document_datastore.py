@@ -45,6 +45,8 @@ def initialise_document_datastore(path: str, delete_existing: bool = False):
     _create_table(conn, './insights_db_datastore_sql/create_document_keywords_table.sql')
     logger.info("Creating document_entities table")
     _create_table(conn, './insights_db_datastore_sql/create_document_entities_table.sql')
+    logger.info("Creating document_organisations table")
+    _create_table(conn, './insights_db_datastore_sql/create_document_organisations_table.sql')
 
 
 def _create_table(conn: Connection, script_path: str):
@@ -65,7 +67,7 @@ def _create_table(conn: Connection, script_path: str):
 def delete_existing_datastore(conn: Connection):
     # DB exists so drop existing tables
     cur = conn.cursor()
-    tables_to_drop = ["document_entities", "document_controversy", "document_keywords", "document_part_scores",
+    tables_to_drop = ["document_organisations", "document_entities", "document_controversy", "document_keywords", "document_part_scores",
                       "document_parts", "documents"]
 
     for table in tables_to_drop:
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS document_organisations (
+	id integer PRIMARY KEY,
+	document_id integer NOT NULL,
+	org_id integer NOT NULL,
+	mention text NOT NULL,
+    FOREIGN KEY (document_id) REFERENCES documents(id),
+    FOREIGN KEY (org_id) REFERENCES organisations(id)
+);
\ No newline at end of file